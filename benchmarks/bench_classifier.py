@@ -0,0 +1,132 @@
+"""Benchmark of the classification of judge responses.
+
+Compares the previous classification (correctness flags, then the
+anonymity level with IP addresses searched for again in the lowercased
+body) with the single scan of ``_ResponseScan``.
+
+Usage::
+
+    python benchmarks/bench_classifier.py [--number N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from proxybroker.checker import (  # noqa
+    _COOKIE,
+    _REFERER,
+    _check_test_response,
+    _get_anonymity_lvl,
+    _ResponseScan,
+)
+from proxybroker.utils import IPPattern  # noqa
+
+RV = '4821'
+REAL_IP = '93.184.216.34'
+MARKS = {'via': 0, 'proxy': 0}
+
+HTTPBIN = json.dumps(
+    {
+        'args': {'show_env': '1'},
+        'headers': {
+            'Accept': '*/*',
+            'Accept-Encoding': 'gzip, deflate',
+            'Cookie': _COOKIE,
+            'Host': 'httpbin.org',
+            'Referer': _REFERER,
+            'User-Agent': 'PxBroker/0.3.2/%s' % RV,
+            'X-Forwarded-For': '203.0.113.7',
+            'Via': '1.1 proxy.example.com (squid/3.5.27)',
+        },
+        'origin': '203.0.113.7, 198.51.100.4',
+        'url': 'http://httpbin.org/get?show_env',
+    },
+    indent=2,
+)
+AZENV = (
+    '<html><head><title>AZ Environment variables 1.04</title></head>'
+    '<body><pre>\n'
+    'REMOTE_ADDR = 198.51.100.4\nREMOTE_PORT = 51234\n'
+    'REQUEST_METHOD = GET\nREQUEST_URI = /azenv.php\n'
+    'REQUEST_TIME_FLOAT = 1539943200.1234\nREQUEST_TIME = 1539943200\n'
+    'HTTP_USER_AGENT = PxBroker/0.3.2/%s\nHTTP_ACCEPT = */*\n'
+    'HTTP_ACCEPT_ENCODING = gzip, deflate\nHTTP_COOKIE = %s\n'
+    'HTTP_REFERER = %s\nHTTP_CONNECTION = close\n</pre>\n%s</body></html>'
+) % (RV, _COOKIE, _REFERER, '<p>Lorem ipsum dolor sit amet, v1.2.</p>\n' * 60)
+BIG = AZENV + '<p>Version 2.4.1 of 12.10.2018, 3.14 * 2.71 = 8.51</p>\n' * 1000
+
+PAGES = (('httpbin', HTTPBIN), ('azenv', AZENV), ('big', BIG))
+
+
+class _Proxy:
+    def log(self, *args, **kwargs):
+        pass
+
+
+class _Judge:
+    marks = MARKS
+
+
+def legacy(content):
+    if not all(
+        [
+            RV in content,
+            set(IPPattern.findall(content)),
+            _REFERER in content,
+            _COOKIE in content,
+        ]
+    ):
+        return False, None
+    content = content.lower()
+    ips = set(IPPattern.findall(content))
+    via = (content.count('via') > MARKS['via']) or (
+        content.count('proxy') > MARKS['proxy']
+    )
+    if REAL_IP in ips:
+        return True, 'Transparent'
+    return True, 'Anonymous' if via else 'High'
+
+
+def scan(content, proxy=_Proxy(), judge=_Judge()):
+    scan = _ResponseScan(content, RV)
+    if not _check_test_response(proxy, scan):
+        return False, None
+    return True, _get_anonymity_lvl(REAL_IP, proxy, judge, scan)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--number', type=int, default=2000)
+    ns = parser.parse_args()
+
+    print(
+        '{:<10} {:>9} {:>12} {:>10} {:>8}'.format(
+            'page', 'size, KB', 'legacy, us', 'scan, us', 'speedup'
+        )
+    )
+    for name, page in PAGES:
+        if legacy(page) != scan(page):
+            print('%s: results differ!' % name)
+        times = [
+            min(timeit.repeat(lambda: func(page), number=ns.number, repeat=3))
+            / ns.number
+            for func in (legacy, scan)
+        ]
+        print(
+            '{:<10} {:>9.1f} {:>12.1f} {:>10.1f} {:>7.1f}x'.format(
+                name,
+                len(page) / 1024,
+                times[0] * 1e6,
+                times[1] * 1e6,
+                times[0] / times[1],
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark of header parsing: ``parse_headers`` and ``HeaderView``.
+
+Each message is parsed and then only the headers that the callers
+actually look at are read, e.g. the status and the body size of a judge
+response, or the method and the host of a client request to the server.
+
+Usage::
+
+    python benchmarks/bench_headers.py [--number N]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from proxybroker.utils import HeaderView, parse_headers  # noqa
+
+JUDGE_RESPONSE = (
+    b'HTTP/1.1 200 OK\r\n'
+    b'Date: Mon, 19 Oct 2026 10:00:00 GMT\r\n'
+    b'Content-Type: application/json\r\n'
+    b'Content-Length: 1033\r\n'
+    b'Connection: keep-alive\r\n'
+    b'Server: gunicorn/19.9.0\r\n'
+    b'Access-Control-Allow-Origin: *\r\n'
+    b'Access-Control-Allow-Credentials: true\r\n\r\n'
+) + b'{"args": {"show_env": "1"}, "headers": {}}' * 24
+CHUNKED_RESPONSE = (
+    b'HTTP/1.1 200 OK\r\n'
+    b'Server: nginx\r\n'
+    b'Date: Mon, 19 Oct 2026 10:00:00 GMT\r\n'
+    b'Content-Type: text/html\r\n'
+    b'Transfer-Encoding: chunked\r\n'
+    b'Connection: keep-alive\r\n'
+    b'Content-Encoding: gzip\r\n\r\n'
+) + b'278\r\n' + b'\x1f\x8b' * 316 + b'\r\n0\r\n\r\n'
+CLIENT_REQUEST = (
+    b'GET http://example.com/path?query=1 HTTP/1.1\r\n'
+    b'Host: example.com\r\n'
+    b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:60.0) Firefox/60.0\r\n'
+    b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9\r\n'
+    b'Accept-Language: en-US,en;q=0.5\r\n'
+    b'Accept-Encoding: gzip, deflate\r\n'
+    b'Cookie: session=0123456789abcdef; theme=dark\r\n'
+    b'Connection: keep-alive\r\n'
+    b'Upgrade-Insecure-Requests: 1\r\n\r\n'
+)
+CONNECT_REQUEST = (
+    b'CONNECT example.com:443 HTTP/1.1\r\n'
+    b'Host: example.com:443\r\n'
+    b'User-Agent: curl/7.58.0\r\n'
+    b'Proxy-Connection: Keep-Alive\r\n\r\n'
+)
+
+CASES = (
+    # (name, message, names of the read headers)
+    ('judge response', JUDGE_RESPONSE, ('Status', 'Content-Length')),
+    (
+        'chunked response',
+        CHUNKED_RESPONSE,
+        ('Status', 'Content-Length', 'Transfer-Encoding'),
+    ),
+    ('decompress', CHUNKED_RESPONSE, ('Content-Encoding', 'Transfer-Encoding')),
+    ('client request', CLIENT_REQUEST, ('Method', 'Path', 'Host')),
+    ('CONNECT request', CONNECT_REQUEST, ('Method', 'Host', 'Port')),
+)
+
+
+def read(parse, message, names):
+    headers = parse(message)
+    return [headers.get(name) for name in names]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--number', type=int, default=20000)
+    ns = parser.parse_args()
+
+    print(
+        '{:<20} {:>18} {:>18} {:>8}'.format(
+            'message', 'parse_headers, us', 'HeaderView, us', 'speedup'
+        )
+    )
+    for name, message, names in CASES:
+        if read(parse_headers, message, names) != read(
+            HeaderView, message, names
+        ):
+            print('%s: results differ!' % name)
+        times = [
+            min(
+                timeit.repeat(
+                    lambda: read(parse, message, names),
+                    number=ns.number,
+                    repeat=3,
+                )
+            )
+            / ns.number
+            for parse in (parse_headers, HeaderView)
+        ]
+        print(
+            '{:<20} {:>18.2f} {:>18.2f} {:>7.1f}x'.format(
+                name, times[0] * 1e6, times[1] * 1e6, times[0] / times[1]
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
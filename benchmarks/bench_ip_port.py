@@ -0,0 +1,122 @@
+"""Benchmark of IP:port extraction from provider pages.
+
+Compares ``IPPortPatternGlobal`` (regex with a DOTALL lookahead) with
+the single-pass ``IPPortTokenizer`` used by :class:`Provider`.
+
+Usage::
+
+    python benchmarks/bench_ip_port.py [DIR_WITH_SAVED_PAGES ...]
+
+Without arguments, synthetic pages are generated, from a small list to
+a multi-megabyte one.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from proxybroker.utils import IPPortPatternGlobal, IPPortTokenizer  # noqa
+
+ROW = (
+    '<tr><td class="ip">{ip}</td>\n<td>{port}</td><td>{country}</td>'
+    '<td>elite proxy</td><td class="hm">yes</td><td>{ago} minutes ago</td>'
+    '</tr>\n'
+)
+
+
+def make_page(size):
+    rnd = random.Random(size)
+    rows = ['<html><body><table>\n']
+    length = 0
+    while length < size:
+        row = ROW.format(
+            ip='.'.join(str(rnd.randint(1, 254)) for _ in range(4)),
+            port=rnd.choice((80, 3128, 8080, 8118, rnd.randint(1000, 65535))),
+            country=rnd.choice(('US', 'DE', 'RU', 'BR', 'CN')),
+            ago=rnd.randint(1, 59),
+        )
+        rows.append(row)
+        length += len(row)
+    rows.append('</table></body></html>\n')
+    return ''.join(rows)
+
+
+def make_page_with_tail(size):
+    # the last IP address is followed by a long text without any port,
+    # the regex re-scans this text for every variant of the last octet
+    page = make_page(size)
+    return page + '<p>127.0.0.1 ' + 'lorem ipsum dolor sit amet ' * (size // 27)
+
+
+def load_pages(paths):
+    pages = []
+    for path in paths:
+        names = (
+            [os.path.join(path, name) for name in sorted(os.listdir(path))]
+            if os.path.isdir(path)
+            else [path]
+        )
+        for name in names:
+            if not os.path.isfile(name):
+                continue
+            with open(name, encoding='utf-8', errors='ignore') as f:
+                pages.append((os.path.basename(name), f.read()))
+    return pages
+
+
+def measure(func, page, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        stime = time.perf_counter()
+        result = func(page)
+        best = min(best, time.perf_counter() - stime)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('paths', nargs='*', help='Saved pages or directories')
+    parser.add_argument('--repeat', type=int, default=3)
+    ns = parser.parse_args()
+
+    if ns.paths:
+        pages = load_pages(ns.paths)
+    else:
+        sizes = (16 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+        pages = [('synthetic-%dKB' % (n // 1024), make_page(n)) for n in sizes]
+        pages += [
+            ('synthetic-tail-%dKB' % (n // 1024), make_page_with_tail(n))
+            for n in sizes[-2:]
+        ]
+
+    tokenizer = IPPortTokenizer()
+    print(
+        '{:<32} {:>10} {:>9} {:>12} {:>12} {:>8}'.format(
+            'page', 'size, KB', 'proxies', 'regex, ms', 'tokens, ms', 'speedup'
+        )
+    )
+    for name, page in pages:
+        t_regex, expected = measure(
+            IPPortPatternGlobal.findall, page, ns.repeat
+        )
+        t_tokens, result = measure(tokenizer.findall, page, ns.repeat)
+        if result != expected:
+            print('%s: results differ!' % name)
+        print(
+            '{:<32.32} {:>10.1f} {:>9} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(
+                name,
+                len(page) / 1024,
+                len([port for _, port in result if port]),
+                t_regex * 1000,
+                t_tokens * 1000,
+                t_regex / t_tokens if t_tokens else 0,
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Benchmark of parsing of provider pages recorded by ``PageStore``.
+
+Every provider from ``PROVIDERS`` that has recorded pages in the
+directory is run offline (pages are replayed instead of requested),
+then the parse throughput is reported per provider class.
+
+Usage::
+
+    # record pages from the live sites once
+    python benchmarks/bench_providers.py --record DIR
+    # replay them as many times as needed
+    python benchmarks/bench_providers.py DIR [--repeat N]
+
+The same directory can be recorded with ``proxybroker grab
+--record-pages DIR``.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from proxybroker.providers import PROVIDERS, PageStore  # noqa
+
+
+def run(loop, provider):
+    # parse all pages on every repeat, not only the changed ones
+    provider._page_hashes.clear()
+    provider.proxies.clear()
+    return loop.run_until_complete(provider.get_proxies())
+
+
+def record(loop, path):
+    store = PageStore(path)
+    for pr in PROVIDERS:
+        pr.store = store
+        stime = time.perf_counter()
+        proxies = run(loop, pr)
+        print(
+            '{:<40.40} {:>6} pages {:>7} proxies {:>7.1f}s'.format(
+                pr.domain,
+                pr.stat['pages'],
+                len(proxies),
+                time.perf_counter() - stime,
+            )
+        )
+
+
+def replay(loop, path, repeat):
+    store = PageStore(path, replay=True)
+    recorded = set(os.listdir(path))
+    print(
+        '{:<40} {:<20} {:>6} {:>9} {:>10} {:>9} {:>12}'.format(
+            'provider',
+            'class',
+            'pages',
+            'size, KB',
+            'parse, ms',
+            'MB/s',
+            'candidates/s',
+        )
+    )
+    for pr in PROVIDERS:
+        if pr.domain not in recorded:
+            continue
+        pr.store = store
+        best = None
+        for _ in range(repeat):
+            pr.stat.update(pages=0, bytes=0, parse_time=0, received=0)
+            run(loop, pr)
+            if best is None or pr.stat['parse_time'] < best['parse_time']:
+                best = dict(pr.stat)
+        parse_time = best['parse_time'] or float('inf')
+        print(
+            '{:<40.40} {:<20.20} {:>6} {:>9.1f} {:>10.2f} {:>9.2f} {:>12.0f}'
+            .format(
+                pr.domain,
+                pr.__class__.__name__,
+                best['pages'],
+                best['bytes'] / 1024,
+                best['parse_time'] * 1000,
+                best['bytes'] / 1024 / 1024 / parse_time,
+                best['received'] / parse_time,
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path', help='Directory with recorded pages')
+    parser.add_argument(
+        '--record',
+        action='store_true',
+        help='Receive pages from the live sites and save them',
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    ns = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    if ns.record:
+        record(loop, ns.path)
+    else:
+        replay(loop, ns.path, ns.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -26,7 +26,7 @@ __copyright__ = 'Copyright 2015-2018 Constverum'
 
 
 from .proxy import Proxy  # noqa
-from .judge import Judge  # noqa
+from .judge import Judge, JudgePool  # noqa
 from .providers import Provider  # noqa
 from .checker import Checker  # noqa
 from .server import Server, ProxyPool  # noqa
@@ -44,4 +44,13 @@ warnings.simplefilter('always', UserWarning)
 warnings.simplefilter('once', DeprecationWarning)
 
 
-__all__ = (Proxy, Judge, Provider, Checker, Server, ProxyPool, Broker)
+__all__ = (
+    Proxy,
+    Judge,
+    JudgePool,
+    Provider,
+    Checker,
+    Server,
+    ProxyPool,
+    Broker,
+)
@@ -3,12 +3,17 @@ import io
 import signal
 import warnings
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from functools import partial
 from pprint import pprint
 
+import aiohttp
+
+from . import metrics, monitor, tracing
 from .checker import Checker
 from .errors import ResolveError
-from .providers import PROVIDERS, Provider
+from .monitor import LoopMonitor
+from .providers import PROVIDERS, PageParser, PageStore, Provider
 from .proxy import Proxy
 from .resolver import Resolver
 from .server import Server
@@ -20,6 +25,21 @@ GRAB_PAUSE = 180
 # The maximum number of providers that are parsed concurrently
 MAX_CONCURRENT_PROVIDERS = 3
 
+# A provider that returns nothing N times in a row is skipped for 2**N-1
+# next grabbing cycles. The maximum value of N
+MAX_PROVIDER_BACKOFF = 5
+
+# The maximum number of simultaneous connections to the same host
+# (provider, judge or IP discovery service) through the shared connector
+MAX_CONN_PER_HOST = 8
+
+# Time to cache DNS lookups of providers and judges; in seconds
+DNS_CACHE_TTL = GRAB_PAUSE * 2
+
+# Time to keep idle connections open; in seconds.
+# Must be longer than the pause between grabbing cycles
+KEEPALIVE_TIMEOUT = GRAB_PAUSE + 60
+
 
 class Broker:
     """The Broker.
@@ -42,6 +62,26 @@ class Broker:
     :param bool verify_ssl:
         (optional) Flag indicating whether to check the SSL certificates.
         Set to True to check ssl certifications
+    :param str parse_in:
+        (optional) Parse pages of providers in a ``thread`` or ``process``
+        pool instead of the event loop. Heavy pages are not blocking
+        the checks of proxies and the proxy server then
+    :param str record_pages:
+        (optional) Directory where to save the pages received from providers
+    :param str replay_pages:
+        (optional) Directory with pages saved by :attr:`record_pages`.
+        Providers get pages from there instead of sending requests
+    :param int metrics_port:
+        (optional) Port of a HTTP server that exposes metrics
+        in the Prometheus format on ``/metrics``
+    :param float monitor_loop:
+        (optional) Monitor the event loop and report the functions that
+        block it longer than this number of seconds. The measured lag
+        is subtracted from the response times of proxies
+    :param str trace:
+        (optional) Path to a file where to write the stages of checks
+        (resolving, connecting, negotiating, receiving, etc.) in the Chrome
+        trace event format. See :mod:`proxybroker.tracing`
     :param loop: (optional) asyncio compatible event loop
 
     .. deprecated:: 0.2.0
@@ -58,6 +98,12 @@ class Broker:
         judges=None,
         providers=None,
         verify_ssl=False,
+        parse_in=None,
+        record_pages=None,
+        replay_pages=None,
+        metrics_port=None,
+        monitor_loop=None,
+        trace=None,
         loop=None,
         **kwargs
     ):
@@ -71,6 +117,17 @@ class Broker:
         self._all_tasks = []
         self._checker = None
         self._server = None
+        self._connector = None
+        self._metrics_port = metrics_port
+        self._metrics_server = None
+        self._monitor_loop = monitor_loop
+        self._monitor = None
+        self._tracer = None
+        if trace:
+            self._tracer = tracing.ChromeTracer(trace)
+            tracing.set_tracer(self._tracer)
+        # {provider: (number of empty runs in a row, cycles to skip)}
+        self._providers_backoff = {}
         self._limit = 0  # not limited
         self._countries = None
 
@@ -97,8 +154,30 @@ class Broker:
         self._on_check = asyncio.Queue(maxsize=max_conn, loop=self._loop)
         self._max_tries = max_tries
         self._judges = judges
+        if parse_in == 'thread':
+            self._parser = PageParser(ThreadPoolExecutor(), loop=self._loop)
+        elif parse_in == 'process':
+            self._parser = PageParser(ProcessPoolExecutor(), loop=self._loop)
+        elif parse_in:
+            raise ValueError('`parse_in` must be "thread" or "process"')
+        else:
+            self._parser = None
+        if record_pages and replay_pages:
+            raise ValueError(
+                '`record_pages` and `replay_pages` are mutually exclusive'
+            )
+        elif record_pages or replay_pages:
+            store = PageStore(
+                record_pages or replay_pages, replay=bool(replay_pages)
+            )
+        else:
+            store = None
+        # every broker has its own copies of the providers, so the state
+        # (cache of pages, statistics, connector) is not shared
         self._providers = [
-            p if isinstance(p, Provider) else Provider(p)
+            (p if isinstance(p, Provider) else Provider(p)).clone(
+                parser=self._parser, store=store, loop=self._loop
+            )
             for p in (providers or PROVIDERS)
         ]
 
@@ -120,6 +199,9 @@ class Broker:
         """
         self._countries = countries
         self._limit = limit
+        self._get_connector()
+        self._start_monitoring()
+        await self._start_metrics()
         task = asyncio.ensure_future(self._grab(check=False))
         self._all_tasks.append(task)
 
@@ -170,6 +252,7 @@ class Broker:
             Added: :attr:`post`, :attr:`strict`, :attr:`dnsbl`.
             Changed: :attr:`types` is required.
         """
+        connector = self._get_connector()
         ip = await self._resolver.get_real_ext_ip()
         types = _update_types(types)
 
@@ -186,10 +269,15 @@ class Broker:
             post=post,
             strict=strict,
             dnsbl=dnsbl,
+            connector=connector,
             loop=self._loop,
         )
+        if self._server:
+            self._server.prober = self._checker
         self._countries = countries
         self._limit = limit
+        self._start_monitoring()
+        await self._start_metrics()
 
         tasks = [asyncio.ensure_future(self._checker.check_judges())]
         if data:
@@ -258,6 +346,57 @@ class Broker:
         :param int backlog:
             (optional) The maximum number of queued connections passed to
             listen. The default value is 100
+        :param bool hedge:
+            (optional) Flag that indicates whether to hedge GET and HEAD
+            requests over HTTP. If a proxy has not returned the response
+            headers within the 95th percentile of the recent response times,
+            the request is also sent through another proxy and the first
+            response is returned. The slower proxy is counted as an error.
+            The default value is False
+        :param int probe_interval:
+            (optional) Interval in seconds between background checks of
+            a proxy that is idle in the pool. A proxy that failed the check
+            is moved after the working ones, and removed from the pool after
+            the second failure in a row. By default the checks are disabled
+        :param int max_probes:
+            (optional) The maximum number of concurrent background checks.
+            They never take more than half of the idle proxies, so that
+            the checks do not compete with the incoming requests.
+            The default value is 2
+        :param int max_errors_in_row:
+            (optional) The number of failed requests in a row after which
+            a proxy is quarantined: not used for :attr:`quarantine_time`
+            seconds. Then the first request decides whether the proxy is
+            healthy again or goes back to quarantine for twice as long.
+            The default value is 3
+        :param int quarantine_time:
+            (optional) The duration of the first quarantine in seconds.
+            The default value is 30
+        :param int max_quarantines:
+            (optional) The number of quarantines in a row after which
+            a proxy is removed from the pool. The default value is 3
+        :param str sticky:
+            (optional) Send the requests of one session through the same
+            proxy while it is working. The session is identified by
+            the ``client`` address, the ``header`` :attr:`sticky_header`
+            or the target ``host``. By default proxies are not pinned
+        :param str sticky_header:
+            (optional) The request header with the session identifier.
+            The default value is ``X-Proxy-Session``
+        :param int sticky_ttl:
+            (optional) Time in seconds since the last request of a session
+            after which it is unpinned. The default value is 600
+        :param str strategy:
+            (optional) How to choose a proxy for a request from the pool:
+            ``best`` - with the lowest error rate and response time;
+            ``p2c`` - the less loaded of two random proxies;
+            ``least_outstanding`` - with the fewest requests in progress;
+            ``weighted`` - random, weighted by the inverse of response time.
+            The default value is ``best``
+        :param int max_inflight:
+            (optional) The maximum number of requests that are sent
+            through a proxy at the same time. When all the proxies are busy,
+            the incoming requests wait for a free one. The default value is 1
 
         :raises ValueError:
             If :attr:`limit` is less than or equal to zero.
@@ -287,6 +426,33 @@ class Broker:
         task = asyncio.ensure_future(self.find(limit=limit, **kwargs))
         self._all_tasks.append(task)
 
+    def _get_connector(self):
+        """Return the HTTP connector shared by providers, judges and resolver.
+
+        Reusing the connector across grabbing cycles keeps the DNS cache
+        and keep-alive connections to the same sites.
+        """
+        if self._connector is None or self._connector.closed:
+            self._connector = aiohttp.TCPConnector(
+                limit_per_host=MAX_CONN_PER_HOST,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                loop=self._loop,
+            )
+            self._resolver.connector = self._connector
+            for pr in self._providers:
+                pr.connector = self._connector
+        return self._connector
+
+    def _close_connector(self):
+        if self._connector is None or self._connector.closed:
+            return
+        closing = self._connector.close()
+        if self._loop.is_running():
+            asyncio.ensure_future(closing)
+        else:
+            self._loop.run_until_complete(closing)
+
     async def _load(self, data, check=True):
         """Looking for proxies in the passed data.
 
@@ -305,28 +471,29 @@ class Broker:
         self._done()
 
     async def _grab(self, types=None, check=False):
-        def _get_tasks(by=MAX_CONCURRENT_PROVIDERS):
-            providers = [
-                pr
-                for pr in self._providers
-                if not types or not pr.proto or bool(pr.proto & types.keys())
-            ]
-            while providers:
-                tasks = [
-                    asyncio.ensure_future(pr.get_proxies())
-                    for pr in providers[:by]
-                ]
-                del providers[:by]
-                self._all_tasks.extend(tasks)
-                yield tasks
-
+        providers = [
+            pr
+            for pr in self._providers
+            if not types or not pr.proto or bool(pr.proto & types.keys())
+        ]
         log.debug('Start grabbing proxies')
         while True:
-            for tasks in _get_tasks():
-                for task in asyncio.as_completed(tasks):
-                    proxies = await task
+            queue = self._schedule_providers(providers, check)
+            pending = set()
+            while queue or pending:
+                # keep the fixed number of providers in progress
+                while queue and len(pending) < MAX_CONCURRENT_PROVIDERS:
+                    pr = queue.pop(0)
+                    task = asyncio.ensure_future(self._get_proxies(pr))
+                    self._all_tasks.append(task)
+                    pending.add(task)
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    pr, proxies = task.result()
                     for proxy in proxies:
-                        await self._handle(proxy, check=check)
+                        await self._handle(proxy, check=check, provider=pr)
             log.debug('Grab cycle is complete')
             if self._server:
                 log.debug('fall asleep for %d seconds' % GRAB_PAUSE)
@@ -337,7 +504,45 @@ class Broker:
         await self._on_check.join()
         self._done()
 
-    async def _handle(self, proxy, check=False):
+    async def _get_proxies(self, provider):
+        received = provider.stat['received'] + provider.stat['unchanged']
+        proxies = await provider.get_proxies()
+        if provider.stat['received'] + provider.stat['unchanged'] > received:
+            self._providers_backoff.pop(provider, None)
+        else:
+            empty_runs, _ = self._providers_backoff.get(provider, (0, 0))
+            empty_runs = min(empty_runs + 1, MAX_PROVIDER_BACKOFF)
+            # skip 1, 3, 7, ... next cycles
+            skip = 2 ** empty_runs - 1
+            self._providers_backoff[provider] = (empty_runs, skip)
+        return provider, proxies
+
+    def _schedule_providers(self, providers, check):
+        """Return providers in order of their yield of proxies.
+
+        The yield is the number of working proxies (or found proxies, if
+        they are not checked) per second spent on the provider. Providers
+        which have not been used yet go first, providers which repeatedly
+        return nothing are skipped for a growing number of cycles.
+        """
+
+        def _yield(pr):
+            if not pr.stat['runs']:
+                return float('inf')
+            found = pr.stat['working'] if check else pr.stat['received']
+            return found / (pr.stat['runtime'] or 1)
+
+        queue = []
+        for pr in providers:
+            empty_runs, skip = self._providers_backoff.get(pr, (0, 0))
+            if skip:
+                self._providers_backoff[pr] = (empty_runs, skip - 1)
+                log.debug('%s is skipped in this cycle' % pr.domain)
+            else:
+                queue.append(pr)
+        return sorted(queue, key=_yield, reverse=True)
+
+    async def _handle(self, proxy, check=False, provider=None):
         try:
             proxy = await Proxy.create(
                 *proxy,
@@ -348,8 +553,14 @@ class Broker:
             )
         except (ResolveError, ValueError):
             return
+        proxy.provider = provider
 
-        if not self._is_unique(proxy) or not self._geo_passed(proxy):
+        if not self._is_unique(proxy):
+            return
+        if provider:
+            provider.stat['unique'] += 1
+            metrics.CANDIDATES.inc(provider.domain)
+        if not self._geo_passed(proxy):
             return
 
         if check:
@@ -373,25 +584,34 @@ class Broker:
 
     async def _push_to_check(self, proxy):
         def _task_done(proxy, f):
+            metrics.CHECKS_IN_FLIGHT.dec()
             self._on_check.task_done()
             if not self._on_check.empty():
                 self._on_check.get_nowait()
             try:
                 if f.result():
                     # proxy is working and its types is equal to the requested
+                    if proxy.provider:
+                        proxy.provider.stat['working'] += 1
                     self._push_to_result(proxy)
             except asyncio.CancelledError:
                 pass
 
-        if self._server and not self._proxies.empty() and self._limit <= 0:
-            log.debug(
-                'pause. proxies: %s; limit: %s'
-                % (self._proxies.qsize(), self._limit)
-            )
-            await self._proxies.join()
-            log.debug('unpause. proxies: %s' % self._proxies.qsize())
-
-        await self._on_check.put(None)
+        with tracing.span('queue_wait', proxy=proxy):
+            if (
+                self._server
+                and not self._proxies.empty()
+                and self._limit <= 0
+            ):
+                log.debug(
+                    'pause. proxies: %s; limit: %s'
+                    % (self._proxies.qsize(), self._limit)
+                )
+                await self._proxies.join()
+                log.debug('unpause. proxies: %s' % self._proxies.qsize())
+
+            await self._on_check.put(None)
+        metrics.CHECKS_IN_FLIGHT.inc()
         task = asyncio.ensure_future(self._checker.check(proxy))
         task.add_done_callback(partial(_task_done, proxy))
         self._all_tasks.append(task)
@@ -406,6 +626,25 @@ class Broker:
         if self._limit == 0 and not self._server:
             self._done()
 
+    async def _start_metrics(self):
+        if not self._metrics_port or self._metrics_server:
+            return
+        self._metrics_server = await metrics.start_server(
+            port=self._metrics_port, loop=self._loop
+        )
+
+    def _start_monitoring(self):
+        if not (self._monitor_loop or self._metrics_port) or self._monitor:
+            return
+        if monitor.get_current():  # started by another broker
+            return
+        # the lag is only subtracted from runtimes if it's asked for
+        self._monitor = LoopMonitor(
+            slow_callback=self._monitor_loop,
+            discount_lag=bool(self._monitor_loop),
+            loop=self._loop,
+        ).start()
+
     def stop(self):
         """Stop all tasks, and the local proxy server if it's running."""
         self._done()
@@ -420,6 +659,19 @@ class Broker:
             task = self._all_tasks.pop()
             if not task.done():
                 task.cancel()
+        self._close_connector()
+        if self._parser:
+            self._parser.close()
+        if self._metrics_server:
+            self._metrics_server.close()
+            self._metrics_server = None
+        if self._monitor:
+            self._monitor.stop()
+            self._monitor = None
+        if self._tracer:
+            tracing.set_tracer(None)
+            self._tracer.close()
+            self._tracer = None
         self._push_to_result(None)
         log.info('Done! Total found proxies: %d' % len(self.unique_proxies))
 
@@ -513,6 +765,73 @@ class Broker:
             print('%s (%s): %s' % (proto, len(proxies), proxies))
         print('Errors:', errors)
 
+    def get_provider_stats(self):
+        """Return statistics on the providers.
+
+        :return:
+            List of dicts, one per provider, from the most productive.
+            Where ``domain`` is the domain of the provider and
+            the other keys are:
+
+            * ``runs`` - Number of grabbing cycles the provider was used in
+            * ``pages`` - Number of received pages
+            * ``errors`` - Number of failed requests
+            * ``bytes`` - Size of received pages
+            * ``avg_fetch_time`` - Average time of receiving a page
+            * ``parse_time`` - Time spent on parsing of pages
+            * ``received`` - Number of found proxies (with duplicates)
+            * ``unique`` - Number of found proxies that have not been found
+              by other providers before
+            * ``working`` - Number of found proxies passed the checks
+        :rtype: list
+        """
+        stats = []
+        for pr in self._providers:
+            stat = dict(pr.stat, domain=pr.domain)
+            stat['avg_fetch_time'] = round(
+                stat.pop('fetch_time') / (stat['pages'] or 1), 2
+            )
+            stat['parse_time'] = round(stat['parse_time'], 2)
+            stat['runtime'] = round(stat['runtime'], 2)
+            stats.append(stat)
+        return sorted(
+            stats, key=lambda s: (s['working'], s['unique']), reverse=True
+        )
+
+    def show_provider_stats(self):
+        """Show statistics on the providers.
+
+        See :meth:`get_provider_stats` for the details.
+        """
+        row = '{:<32.32} {:>5} {:>6} {:>9} {:>7} {:>7} {:>8} {:>7} {:>7}'
+        print(
+            row.format(
+                'Provider',
+                'Pages',
+                'Errors',
+                'KB',
+                'Fetch',
+                'Parse',
+                'Received',
+                'Unique',
+                'Working',
+            )
+        )
+        for stat in self.get_provider_stats():
+            print(
+                row.format(
+                    stat['domain'],
+                    stat['pages'],
+                    stat['errors'],
+                    stat['bytes'] // 1024,
+                    '%.2fs' % stat['avg_fetch_time'],
+                    '%.2fs' % stat['parse_time'],
+                    stat['received'],
+                    stat['unique'],
+                    stat['working'],
+                )
+            )
+
 
 def _update_types(types):
     _types = {}
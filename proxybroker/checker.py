@@ -1,8 +1,11 @@
 import asyncio
+import codecs
+import random
 import time
 import warnings
 import zlib
 
+from . import metrics, tracing
 from .errors import (
     BadResponseError,
     BadStatusError,
@@ -13,10 +16,21 @@ from .errors import (
     ProxyTimeoutError,
     ResolveError,
 )
-from .judge import Judge, get_judges
+from .judge import JudgePool, get_judges, get_scheme
 from .negotiators import NGTRS
 from .resolver import Resolver
-from .utils import get_all_ip, get_headers, get_status_code, log, parse_headers
+from .utils import get_all_ip, get_headers, get_status_code, iter_ips, log
+
+# the protocols that are checked with the judges of the scheme
+_SCHEME_PROTOS = {
+    'HTTP': ('HTTP', 'CONNECT:80', 'SOCKS4', 'SOCKS5'),
+    'HTTPS': ('HTTPS',),
+    'SMTP': ('CONNECT:25',),
+}
+
+# the headers of test requests that the judge must show in the response
+_REFERER = get_headers()['Referer']
+_COOKIE = get_headers()['Cookie']
 
 
 class Checker:
@@ -33,11 +47,14 @@ class Checker:
         real_ext_ip=None,
         types=None,
         post=False,
+        connector=None,
         loop=None,
     ):
-        Judge.clear()
-        self._judges = get_judges(judges, timeout, verify_ssl)
+        self._judges = get_judges(judges, timeout, verify_ssl, connector)
+        self.judge_pool = JudgePool()
         self._method = 'POST' if post else 'GET'
+        # {(judge, full path): _RequestTemplate}
+        self._templates = {}
         self._max_tries = max_tries
         self._real_ext_ip = real_ext_ip
         self._strict = strict
@@ -46,68 +63,61 @@ class Checker:
         self._loop = loop or asyncio.get_event_loop()
         self._resolver = Resolver(loop=self._loop)
 
-        self._req_http_proto = not types or bool(
-            ('HTTP', 'CONNECT:80', 'SOCKS4', 'SOCKS5') & types.keys()
-        )
-        self._req_https_proto = not types or bool(('HTTPS',) & types.keys())
-        self._req_smtp_proto = not types or bool(
-            ('CONNECT:25',) & types.keys()
-        )  # noqa
-
         self._ngtrs = {proto for proto in types or NGTRS}
 
     async def check_judges(self):
-        # TODO: need refactoring
+        """Verify the judges.
+
+        The judges of each scheme are checked in parallel. The checks of
+        proxies on a scheme start as soon as its first judge is verified,
+        and the others are added to :attr:`judge_pool` as they pass.
+        A scheme is disabled once all of its judges have failed.
+        """
         log.debug('Start check judges')
         stime = time.time()
         await asyncio.gather(
-            *[j.check(real_ext_ip=self._real_ext_ip) for j in self._judges]
+            *[
+                self._check_scheme_judges(scheme, stime)
+                for scheme in self.judge_pool.available
+            ]
         )
-
         self._judges = [j for j in self._judges if j.is_working]
         log.debug(
             '%d judges added. Runtime: %.4f;'
             % (len(self._judges), time.time() - stime)
         )
+        if self._judges:
+            log.debug('Loaded: %d proxy judges' % len(set(self._judges)))
+        else:
+            RuntimeError('Not found judges')
 
-        nojudges = []
-        disable_protocols = []
-
-        if len(Judge.available['HTTP']) == 0:
-            nojudges.append('HTTP')
-            disable_protocols.extend(['HTTP', 'CONNECT:80', 'SOCKS4', 'SOCKS5'])
-            self._req_http_proto = False
-            # for coroutines, which is already waiting
-            Judge.ev['HTTP'].set()
-        if len(Judge.available['HTTPS']) == 0:
-            nojudges.append('HTTPS')
-            disable_protocols.append('HTTPS')
-            self._req_https_proto = False
-            # for coroutines, which is already waiting
-            Judge.ev['HTTPS'].set()
-        if len(Judge.available['SMTP']) == 0:
-            # nojudges.append('SMTP')
-            disable_protocols.append('SMTP')
-            self._req_smtp_proto = False
-            # for coroutines, which is already waiting
-            Judge.ev['SMTP'].set()
-
-        for proto in disable_protocols:
-            if proto in self._ngtrs:
-                self._ngtrs.remove(proto)
-
-        if nojudges:
+    async def _check_scheme_judges(self, scheme, stime):
+        judges = [j for j in self._judges if j.scheme == scheme]
+        await asyncio.gather(*[self._check_judge(j, stime) for j in judges])
+        if self.judge_pool.available[scheme]:
+            return
+        disable_protocols = _SCHEME_PROTOS[scheme]
+        self._ngtrs.difference_update(disable_protocols)
+        # for coroutines, which is already waiting
+        self.judge_pool.ev[scheme].set()
+        if scheme != 'SMTP':
             warnings.warn(
                 'Not found judges for the {nojudges} protocol.\n'
                 'Checking proxy on protocols {disp} is disabled.'.format(
-                    nojudges=nojudges, disp=disable_protocols
+                    nojudges=[scheme], disp=list(disable_protocols)
                 ),
                 UserWarning,
             )
-        if self._judges:
-            log.debug('Loaded: %d proxy judges' % len(set(self._judges)))
-        else:
-            RuntimeError('Not found judges')
+
+    async def _check_judge(self, judge, stime):
+        if not await judge.check(real_ext_ip=self._real_ext_ip):
+            return
+        if not self.judge_pool.available[judge.scheme]:
+            log.debug(
+                '%s judges are ready. Runtime: %.4f;'
+                % (judge.scheme, time.time() - stime)
+            )
+        self.judge_pool.add(judge)
 
     def _types_passed(self, proxy):
         if not self._types:
@@ -139,18 +149,17 @@ class Checker:
         return False
 
     async def check(self, proxy):
+        with tracing.span('check', proxy=proxy):
+            return await self._check_all(proxy)
+
+    async def _check_all(self, proxy):
         if self._dnsbl:
-            if await self._in_DNSBL(proxy.host):
+            with tracing.span('dnsbl', proxy=proxy):
+                in_dnsbl = await self._in_DNSBL(proxy.host)
+            if in_dnsbl:
                 proxy.log('Found in DNSBL')
                 return False
 
-        if self._req_http_proto:
-            await Judge.ev['HTTP'].wait()
-        if self._req_https_proto:
-            await Judge.ev['HTTPS'].wait()
-        if self._req_smtp_proto:
-            await Judge.ev['SMTP'].wait()
-
         if proxy.expected_types:
             ngtrs = proxy.expected_types & self._ngtrs
         else:
@@ -158,10 +167,20 @@ class Checker:
 
         results = []
         for proto in ngtrs:
-            if proto == 'CONNECT:25':
-                result = await self._check_conn_25(proxy, proto)
-            else:
-                result = await self._check(proxy, proto)
+            # wait for the judges of this protocol only
+            scheme = get_scheme(proto)
+            with tracing.span('judge_wait', proxy=proxy, proto=proto):
+                await self.judge_pool.ev[scheme].wait()
+            if not self.judge_pool.available[scheme]:
+                continue  # checking of the protocol is disabled
+            stime = time.time()
+            with tracing.span('check_proto', proxy=proxy, proto=proto):
+                if proto == 'CONNECT:25':
+                    result = await self._check_conn_25(proxy, proto)
+                else:
+                    result = await self._check(proxy, proto)
+            metrics.CHECK_TIME.observe(time.time() - stime, proto)
+            metrics.CHECKS.inc(proto, 'working' if result else 'failed')
             results.append(result)
 
         proxy.is_working = True if any(results) else False
@@ -170,15 +189,38 @@ class Checker:
             return True
         return False
 
+    async def probe(self, proxy):
+        """Check that a proxy in use still works.
+
+        A lightweight version of :meth:`check`: a single attempt on one of
+        the protocols which the proxy is known to support.
+
+        :return: False if the proxy failed the check
+        """
+        protos = [
+            proto
+            for proto in proxy.types
+            if proto in self._ngtrs and proto != 'CONNECT:25'
+        ]
+        if not protos:
+            return True
+        proto = random.choice(protos)
+        scheme = get_scheme(proto)
+        await self.judge_pool.ev[scheme].wait()
+        if not self.judge_pool.available[scheme]:
+            return True
+        return await self._check(proxy, proto, max_tries=1)
+
     async def _check_conn_25(self, proxy, proto):
-        judge = Judge.get_random(proto)
+        judge = self.judge_pool.get_random(proto)
         proxy.log('Selected judge: %s' % judge)
         result = False
         for attempt in range(self._max_tries):
             try:
                 proxy.ngtr = proto
                 await proxy.connect()
-                await proxy.ngtr.negotiate(host=judge.host, ip=judge.ip)
+                with tracing.span('negotiate', proxy=proxy, proto=proto):
+                    await proxy.ngtr.negotiate(host=judge.host, ip=judge.ip)
             except ProxyTimeoutError:
                 continue
             except (
@@ -198,17 +240,24 @@ class Checker:
                 proxy.close()
         return result
 
-    async def _check(self, proxy, proto):
-        judge = Judge.get_random(proto)
+    async def _check(self, proxy, proto, max_tries=None, exclude=None):
+        judge = self.judge_pool.get_random(proto, exclude)
+        if judge is None:  # no other judge to recheck the proxy
+            return False
         proxy.log('Selected judge: %s' % judge)
-        result = False
-        for attempt in range(self._max_tries):
+        result = judge_failed = False
+        for attempt in range(max_tries or self._max_tries):
             try:
                 proxy.ngtr = proto
                 await proxy.connect()
-                await proxy.ngtr.negotiate(host=judge.host, ip=judge.ip)
-                headers, content, rv = await _send_test_request(
-                    self._method, proxy, judge
+                with tracing.span('negotiate', proxy=proxy, proto=proto):
+                    await proxy.ngtr.negotiate(host=judge.host, ip=judge.ip)
+                stime = time.time()
+                content, rv = await _send_test_request(
+                    self._get_template(judge, proxy.ngtr.use_full_path),
+                    proxy,
+                    judge,
+                    self._real_ext_ip,
                 )
             except ProxyTimeoutError:
                 continue
@@ -217,26 +266,55 @@ class Checker:
                 ProxyRecvError,
                 ProxySendError,
                 ProxyEmptyRecvError,
-                BadStatusError,
-                BadResponseError,
             ):
                 break
+            except (BadStatusError, BadResponseError):
+                judge_failed = True
+                break
             else:
-                content = _decompress_content(headers, content)
-                result = _check_test_response(proxy, headers, content, rv)
-                if result:
-                    if proxy.ngtr.check_anon_lvl:
-                        lvl = _get_anonymity_lvl(
-                            self._real_ext_ip, proxy, judge, content
+                with tracing.span('classify', proxy=proxy, proto=proto):
+                    scan = _ResponseScan(content, rv)
+                    result = _check_test_response(proxy, scan)
+                    if result:
+                        # it's mostly the speed of the proxy, so it isn't
+                        # taken into account in the weight of the judge
+                        metrics.JUDGE_TIME.observe(
+                            time.time() - stime, judge.host
                         )
+                        judge.record_success()
+                        if proxy.ngtr.check_anon_lvl:
+                            lvl = _get_anonymity_lvl(
+                                self._real_ext_ip, proxy, judge, scan
+                            )
+                        else:
+                            lvl = None
+                        proxy.types[proxy.ngtr.name] = lvl
                     else:
-                        lvl = None
-                    proxy.types[proxy.ngtr.name] = lvl
+                        judge_failed = True
                 break
             finally:
                 proxy.close()
+        if judge_failed and judge.record_bad_response() and exclude is None:
+            # the proxy has reached the judge, but the response is bad;
+            # after many such responses in a row the judge may be down,
+            # which is confirmed if the proxy works with another judge
+            proxy.log('Recheck with another judge')
+            result = await self._check(proxy, proto, max_tries, judge)
+            if not result:  # the proxy is bad
+                judge.bad_in_row = 0
+            elif judge.record_failure():  # the judge is bad
+                judge.evict()
         return result
 
+    def _get_template(self, judge, fullpath):
+        key = (judge, fullpath)
+        template = self._templates.get(key)
+        if template is None:
+            template = self._templates[key] = _RequestTemplate(
+                self._method, judge.host, judge.path, fullpath
+            )
+        return template
+
 
 def _request(method, host, path, fullpath=False, data=''):
     hdrs, rv = get_headers(rv=True)
@@ -259,91 +337,210 @@ def _request(method, host, path, fullpath=False, data=''):
     return req, rv
 
 
-async def _send_test_request(method, proxy, judge):
+class _RequestTemplate:
+    """The test request to a judge, built once.
+
+    Only the random ``rv`` token at the end of the User-Agent (the judge
+    shows it in the response) differs between the requests, so it's
+    spliced between the prebuilt bytes.
+    """
+
+    def __init__(self, method, host, path, fullpath=False):
+        req, rv = _request(method, host, path, fullpath)
+        prefix, suffix = req.split(('/%s\r\n' % rv).encode(), 1)
+        self._prefix, self._suffix = prefix + b'/', b'\r\n' + suffix
+
+    def render(self):
+        """Return the request and its rv token."""
+        rv = str(random.randint(1000, 9999))
+        return b''.join((self._prefix, rv.encode(), self._suffix)), rv
+
+
+async def _send_test_request(template, proxy, judge, real_ext_ip=None):
     resp, content, err = None, None, None
-    request, rv = _request(
-        method=method,
-        host=judge.host,
-        path=judge.path,
-        fullpath=proxy.ngtr.use_full_path,
-    )
+    request, rv = template.render()
+    body = _JudgeBody(proxy, rv, real_ext_ip, proxy.ngtr.check_anon_lvl)
     try:
         await proxy.send(request)
-        resp = await proxy.recv()
+        resp = await proxy.recv(feed=body.feed)
         code = get_status_code(resp)
         if code != 200:
             err = BadStatusError
             raise err
-        headers, content, *_ = resp.split(b'\r\n\r\n', maxsplit=1)
+        if not resp.endswith(b'\r\n\r\n'):  # the headers are incomplete
+            err = BadResponseError
+            raise err
+        content = body.content
     except ValueError:
         err = BadResponseError
         raise err
     finally:
         proxy.log('Get: %s' % ('success' if content else 'failed'), err=err)
         log.debug(
-            '{h}:{p} [{n}]: ({j}) rv: {rv}, response: {resp}'.format(
+            '{h}:{p} [{n}]: ({j}) rv: {rv}, response: {resp}, {content}'.format(
                 h=proxy.host,
                 p=proxy.port,
                 n=proxy.ngtr.name,
                 j=judge.url,
                 rv=rv,
                 resp=resp,
+                content=body.content,
             )
         )
-    return headers, content, rv
-
-
-def _decompress_content(headers, content):
-    headers = parse_headers(headers)
-    is_compressed = headers.get('Content-Encoding') in ('gzip', 'deflate')
-    is_chunked = headers.get('Transfer-Encoding') == 'chunked'
-    if is_compressed:
-        # gzip: zlib.MAX_WBITS|16;
-        # deflate: -zlib.MAX_WBITS;
-        # auto: zlib.MAX_WBITS|32;
-        if is_chunked:
-            # b'278\r\n\x1f\x8b...\x00\r\n0\r\n\r\n' => b'\x1f\x8b...\x00
-            content = b''.join(content.split(b'\r\n')[1::2])
-        try:
-            content = zlib.decompress(content, zlib.MAX_WBITS | 32)
-        except zlib.error:
-            content = b''
-    return content.decode('utf-8', 'ignore')
-
-
-def _check_test_response(proxy, headers, content, rv):
-    verIsCorrect = rv in content
-    refSupported = get_headers()['Referer'] in content
-    cookieSupported = get_headers()['Cookie'] in content
-    foundIP = get_all_ip(content)
-
-    if all([verIsCorrect, foundIP, refSupported, cookieSupported]):
+    return content, rv
+
+
+class _JudgeBody:
+    """Body of a judge response, decompressed and decoded as it's received.
+
+    :meth:`feed` stops :meth:`Proxy.recv` as soon as the rest of the body
+    can't change the result of the check: the rv token, the headers of
+    the test request and an IP address are shown. If the anonymity level
+    is checked, only the real IP address will do, since it makes the proxy
+    transparent whatever else the body contains.
+
+    :param str rv: The token of the test request
+    :param str real_ext_ip: (optional) The real IP address
+    :param bool check_anon_lvl:
+        (optional) Whether the anonymity level is determined from the body
+    """
+
+    def __init__(self, proxy, rv, real_ext_ip=None, check_anon_lvl=False):
+        self._proxy = proxy
+        self._real_ext_ip = real_ext_ip
+        self._check_anon_lvl = check_anon_lvl
+        self._decompressor = self._decoder = None
+        self._parts = []
+        self._missing = {rv, _REFERER, _COOKIE}
+        # the end of the text kept to find the strings split between parts
+        self._overlap = max(map(len, self._missing)) - 1
+        self._tail = ''
+        # the text after the last position searched for IP addresses
+        self._unscanned = ''
+        self._ip_found = self._real_ip_found = False
+
+    @property
+    def content(self):
+        return ''.join(self._parts)
+
+    def feed(self, headers, data):
+        """Take a part of the body.
+
+        :return: True if the rest of the body is not needed
+        """
+        if headers.get('Status') != 200:
+            return True
+        if self._decoder is None:
+            # gzip: zlib.MAX_WBITS|16;
+            # deflate: -zlib.MAX_WBITS;
+            # auto: zlib.MAX_WBITS|32;
+            if headers.get('Content-Encoding') in ('gzip', 'deflate'):
+                self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+            self._decoder = codecs.getincrementaldecoder('utf-8')('ignore')
+        with tracing.span('decompress', proxy=self._proxy):
+            if self._decompressor is not None:
+                try:
+                    data = self._decompressor.decompress(data)
+                except zlib.error:
+                    self._parts.clear()  # the response is failed
+                    return True
+            text = self._decoder.decode(data)
+        self._parts.append(text)
+        return self._is_enough(text)
+
+    def _is_enough(self, text):
+        if self._missing:
+            window = self._tail + text
+            self._missing = {s for s in self._missing if s not in window}
+            self._tail = window[-self._overlap :]
+        if not self._is_ip_found():
+            unscanned = self._unscanned + text
+            # an IP address is up to 15 characters long, so the matches
+            # that start before the last 15 won't change with more text
+            limit = len(unscanned) - 15
+            pos = 0
+            for m in iter_ips(unscanned, 0, limit):
+                self._ip_found = True
+                if m.group() == self._real_ext_ip:
+                    self._real_ip_found = True
+                if self._is_ip_found():
+                    break
+                pos = m.end()
+            self._unscanned = unscanned[max(pos, limit, 0) :]
+        return not self._missing and self._is_ip_found()
+
+    def _is_ip_found(self):
+        if self._check_anon_lvl:
+            return self._real_ip_found
+        return self._ip_found
+
+
+class _ResponseScan:
+    """What the judge has shown in the response to a test request.
+
+    Both the correctness check and the anonymity level use one scan of
+    the body: IP addresses are searched for once (see :func:`get_all_ip`),
+    the other flags are substring searches, which are faster in CPython
+    than a combined multi-pattern matcher written in Python.
+    """
+
+    __slots__ = ('rv', 'referer', 'cookie', 'ips', '_content', '_marks')
+
+    def __init__(self, content, rv):
+        self.rv = rv in content
+        self.referer = _REFERER in content
+        self.cookie = _COOKIE in content
+        self.ips = get_all_ip(content)
+        self._content = content
+        self._marks = None
+
+    @property
+    def marks(self):
+        """Return the number of 'via' and 'proxy' words in the body.
+
+        Only needed to determine the anonymity level, so counted on demand.
+        """
+        if self._marks is None:
+            lower = self._content.lower()
+            self._marks = {
+                'via': lower.count('via'),
+                'proxy': lower.count('proxy'),
+            }
+        return self._marks
+
+    @property
+    def is_correct(self):
+        return bool(self.rv and self.ips and self.referer and self.cookie)
+
+
+def _check_test_response(proxy, scan):
+    if scan.is_correct:
         proxy.log('Response: correct')
         return True
     else:
         proxy.log(
             'Response: not correct; ip: %s, rv: %s, ref: %s, cookie: %s'
-            % (bool(foundIP), verIsCorrect, refSupported, cookieSupported)
+            % (bool(scan.ips), scan.rv, scan.referer, scan.cookie)
         )
         return False
 
 
-def _get_anonymity_lvl(real_ext_ip, proxy, judge, content):
-    content = content.lower()
-    foundIP = get_all_ip(content)
-
-    via = (content.count('via') > judge.marks['via']) or (
-        content.count('proxy') > judge.marks['proxy']
+def _get_anonymity_lvl(real_ext_ip, proxy, judge, scan):
+    marks = scan.marks
+    via = (marks['via'] > judge.marks['via']) or (
+        marks['proxy'] > judge.marks['proxy']
     )
 
-    if real_ext_ip in foundIP:
+    if real_ext_ip in scan.ips:
         lvl = 'Transparent'
     elif via:
         lvl = 'Anonymous'
     else:
         lvl = 'High'
     proxy.log(
-        'A: {lvl}; {ip}; via(p): {via}'.format(lvl=lvl[:4], ip=foundIP, via=via)
+        'A: {lvl}; {ip}; via(p): {via}'.format(
+            lvl=lvl[:4], ip=scan.ips, via=via
+        )
     )
     return lvl
 
@@ -45,6 +45,7 @@ def create_parser():
     add_outfile_arg(fparser_group)
     add_format_arg(fparser_group)
     add_show_stats_arg(fparser_group)
+    add_provider_stats_arg(fparser_group)
     add_help_arg(fparser_group)
 
     gparser = subparsers.add_parser(
@@ -59,6 +60,7 @@ def create_parser():
     add_outfile_arg(gparser_group)
     add_format_arg(gparser_group)
     add_show_stats_arg(gparser_group)
+    add_provider_stats_arg(gparser_group)
     add_help_arg(gparser_group)
 
     sparser = subparsers.add_parser(
@@ -143,6 +145,52 @@ def add_broker_args(group):
         action='store_true',
         help='Flag indicating whether to check the SSL certificates',
     )
+    group.add_argument(
+        '--parse-in',
+        dest='parse_in',
+        choices=['thread', 'process'],
+        help='''Parse pages of providers in a pool of threads or processes
+                instead of the event loop''',
+    )
+    group.add_argument(
+        '--record-pages',
+        dest='record_pages',
+        metavar='DIR',
+        help='Save the pages received from providers to the directory',
+    )
+    group.add_argument(
+        '--replay-pages',
+        dest='replay_pages',
+        metavar='DIR',
+        help='''Get the pages of providers from the directory (saved by
+                --record-pages) instead of sending requests''',
+    )
+    group.add_argument(
+        '--metrics-port',
+        dest='metrics_port',
+        type=int,
+        help='''Expose metrics in the Prometheus format on
+                http://127.0.0.1:PORT/metrics. The proxy server (serve)
+                also exposes them on its own port''',
+    )
+    group.add_argument(
+        '--monitor-loop',
+        dest='monitor_loop',
+        type=float,
+        nargs='?',
+        const=0.1,
+        metavar='SECONDS',
+        help='''Report the functions that block the event loop longer than
+                SECONDS (default: 0.1) and subtract the loop lag from the
+                response times of proxies''',
+    )
+    group.add_argument(
+        '--trace',
+        dest='trace',
+        metavar='FILE',
+        help='''Write the stages of checks of proxies to the file in the
+                Chrome trace event format (open it in chrome://tracing)''',
+    )
     group.add_argument(
         '--log',
         nargs='?',
@@ -281,6 +329,43 @@ def add_serve_args(group):
         default=100,
         help='The maximum number of queued connections passed to listen',
     )
+    group.add_argument(
+        '--hedge',
+        action='store_true',
+        help='''Flag that indicates whether to send a slow GET request
+                through a second proxy too and return the first response''',
+    )
+    group.add_argument(
+        '--probe-interval',
+        type=int,
+        default=0,
+        dest='probe_interval',
+        metavar='SECONDS',
+        help='''Interval between background checks of an idle proxy
+                in the pool. By default the checks are disabled''',
+    )
+    group.add_argument(
+        '--sticky',
+        choices=['client', 'header', 'host'],
+        help='''Send the requests of the same client address, value of
+                the X-Proxy-Session header or target host through the same
+                proxy while it is working''',
+    )
+    group.add_argument(
+        '--strategy',
+        default='best',
+        choices=['best', 'p2c', 'least_outstanding', 'weighted'],
+        help='''How to choose a proxy for an incoming request.
+                The default value is best''',
+    )
+    group.add_argument(
+        '--max-inflight',
+        type=int,
+        default=1,
+        dest='max_inflight',
+        help='''The maximum number of requests sent through a proxy
+                at the same time. The default value is 1''',
+    )
 
 
 def add_limit_arg(group, _def=0, _help='The maximum number of working proxies'):
@@ -317,6 +402,15 @@ def add_show_stats_arg(group):
     )
 
 
+def add_provider_stats_arg(group):
+    group.add_argument(
+        '--provider-stats',
+        dest='provider_stats',
+        action='store_true',
+        help='Flag indicating whether to print statistics on the providers',
+    )
+
+
 def add_help_arg(group):
     group.add_argument(
         '--help', '-h', action='help', help='Show this help message and exit'
@@ -386,6 +480,12 @@ def cli(args=sys.argv[1:]):
         judges=ns.judges,
         providers=ns.providers,
         verify_ssl=ns.verify_ssl,
+        parse_in=ns.parse_in,
+        record_pages=ns.record_pages,
+        replay_pages=ns.replay_pages,
+        metrics_port=ns.metrics_port,
+        monitor_loop=ns.monitor_loop,
+        trace=ns.trace,
         loop=loop,
     )
 
@@ -418,6 +518,11 @@ def cli(args=sys.argv[1:]):
             max_resp_time=ns.max_resp_time,
             prefer_connect=ns.prefer_connect,
             http_allowed_codes=ns.http_allowed_codes,
+            hedge=ns.hedge,
+            probe_interval=ns.probe_interval,
+            sticky=ns.sticky,
+            strategy=ns.strategy,
+            max_inflight=ns.max_inflight,
             backlog=ns.backlog,
             data=ns.data,
             types=ns.types,
@@ -433,6 +538,8 @@ def cli(args=sys.argv[1:]):
             loop.run_until_complete(asyncio.gather(*tasks, loop=loop))
             if ns.show_stats:
                 broker.show_stats(verbose=True)
+            if ns.provider_stats:
+                broker.show_provider_stats()
         else:
             loop.run_forever()
     except KeyboardInterrupt:
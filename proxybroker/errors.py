@@ -33,6 +33,10 @@ class ProxyEmptyRecvError(ProxyError):
     errmsg = 'empty_response'
 
 
+class ProxyHedgeLostError(ProxyError):
+    errmsg = 'hedge_lost'
+
+
 class BadStatusError(Exception):  # BadStatusLine
     errmsg = 'bad_status'
 
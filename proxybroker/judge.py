@@ -1,25 +1,33 @@
 import asyncio
 import random
+import time
 from urllib.parse import urlparse
 
 import aiohttp
 
+from . import metrics
 from .errors import ResolveError
 from .resolver import Resolver
 from .utils import get_headers, log
 
+# health of judges during the checks of proxies
+ERROR_ALPHA = 0.2  # weight of a new outcome in the moving average
+# bad responses in a row after which the proxy is rechecked with another
+# judge; they're usually caused by the proxy, so the judge isn't blamed
+MAX_BAD_IN_ROW = 5
+# failures of the judge in a row (the proxy works with another judge)
+# after which it's evicted
+MAX_ERRORS_IN_ROW = 2
+EVICTION_TIME = 60  # seconds, doubled on each eviction of a judge
+MIN_WEIGHT = 0.05  # minimum share of the success rate in the weight
+
 
 class Judge:
     """Proxy Judge."""
 
-    available = {'HTTP': [], 'HTTPS': [], 'SMTP': []}
-    ev = {
-        'HTTP': asyncio.Event(),
-        'HTTPS': asyncio.Event(),
-        'SMTP': asyncio.Event(),
-    }
-
-    def __init__(self, url, timeout=8, verify_ssl=False, loop=None):
+    def __init__(
+        self, url, timeout=8, verify_ssl=False, connector=None, loop=None
+    ):
         self.url = url
         self.scheme = urlparse(url).scheme.upper()
         self.host = urlparse(url).netloc
@@ -29,55 +37,97 @@ class Judge:
         self.marks = {'via': 0, 'proxy': 0}
         self.timeout = timeout
         self.verify_ssl = verify_ssl
+        self.connector = connector
+        # response time of the judge itself, measured by :meth:`check`
+        self.latency = None
+        # moving average of the confirmed failures of the judge
+        self.error_rate = 0
+        self.bad_in_row = 0
+        self.errors_in_row = 0
+        self.evicted_until = 0
+        self._evictions = 0
         self._loop = loop or asyncio.get_event_loop()
         self._resolver = Resolver(loop=self._loop)
 
     def __repr__(self):
         return '<Judge [%s] %s>' % (self.scheme, self.host)
 
-    @classmethod
-    def get_random(cls, proto):
-        if proto == 'HTTPS':
-            scheme = 'HTTPS'
-        elif proto == 'CONNECT:25':
-            scheme = 'SMTP'
-        else:
-            scheme = 'HTTP'
-        return random.choice(cls.available[scheme])
-
-    @classmethod
-    def clear(cls):
-        cls.available['HTTP'].clear()
-        cls.available['HTTPS'].clear()
-        cls.available['SMTP'].clear()
-        cls.ev['HTTP'].clear()
-        cls.ev['HTTPS'].clear()
-        cls.ev['SMTP'].clear()
+    @property
+    def is_evicted(self):
+        return self.evicted_until > time.time()
+
+    def record_success(self):
+        """Record a successful check of a proxy through the judge."""
+        self.error_rate -= ERROR_ALPHA * self.error_rate
+        self.bad_in_row = self.errors_in_row = 0
+
+    def record_bad_response(self):
+        """Record a check of a proxy that received a bad response.
+
+        It's usually caused by the proxy, so the weight of the judge
+        isn't changed.
+
+        :return: True if the proxy should be rechecked with another judge
+        """
+        self.bad_in_row += 1
+        return self.bad_in_row >= MAX_BAD_IN_ROW
+
+    def record_failure(self):
+        """Record a failure of the judge: the proxy works with another one.
+
+        :return: True if the judge should be evicted
+        """
+        self.error_rate += ERROR_ALPHA * (1 - self.error_rate)
+        self.errors_in_row += 1
+        return self.errors_in_row >= MAX_ERRORS_IN_ROW
+
+    def evict(self):
+        """Stop choosing the judge for a time that grows with each eviction."""
+        if self.is_evicted:
+            return
+        self._evictions += 1
+        evict_time = EVICTION_TIME * 2 ** (self._evictions - 1)
+        self.evicted_until = time.time() + evict_time
+        self.bad_in_row = self.errors_in_row = 0
+        metrics.JUDGE_EVICTIONS.inc(self.host)
+        log.warning('%s is evicted for %ds' % (self, evict_time))
 
     async def check(self, real_ext_ip):
+        """Verify that the judge works.
+
+        :return: True if the judge works, its ``is_working`` is also set
+        """
         # TODO: need refactoring
         try:
             self.ip = await self._resolver.resolve(self.host)
         except ResolveError:
-            return
+            return False
 
         if self.scheme == 'SMTP':
             self.is_working = True
-            self.available[self.scheme].append(self)
-            self.ev[self.scheme].set()
-            return
+            return True
 
         page = False
         headers, rv = get_headers(rv=True)
-        connector = aiohttp.TCPConnector(
-            loop=self._loop, ssl=self.verify_ssl, force_close=True
-        )
+        if self.connector is None:
+            connector = aiohttp.TCPConnector(
+                loop=self._loop, ssl=self.verify_ssl, force_close=True
+            )
+        else:
+            connector = self.connector
+        stime = time.time()
         try:
             timeout = aiohttp.ClientTimeout(total=self.timeout)
             async with aiohttp.ClientSession(
-                connector=connector, timeout=timeout, loop=self._loop
+                connector=connector,
+                connector_owner=self.connector is None,
+                timeout=timeout,
+                loop=self._loop,
             ) as session, session.get(
-                url=self.url, headers=headers, allow_redirects=False
+                url=self.url,
+                headers=headers,
+                ssl=self.verify_ssl,
+                allow_redirects=False,
             ) as resp:
                 page = await resp.text()
         except (
@@ -87,7 +137,9 @@ class Judge:
             aiohttp.ServerDisconnectedError,
         ) as e:
             log.debug('%s is failed. Error: %r;' % (self, e))
-            return
+            return False
+        latency = time.time() - stime
+        metrics.JUDGE_TIME.observe(latency, self.host)
 
         page = page.lower()
 
@@ -95,8 +147,7 @@ class Judge:
             self.marks['via'] = page.count('via')
             self.marks['proxy'] = page.count('proxy')
             self.is_working = True
-            self.available[self.scheme].append(self)
-            self.ev[self.scheme].set()
+            self.latency = latency
             log.debug('%s is verified' % self)
         else:
             log.debug(
@@ -112,9 +163,72 @@ class Judge:
                     word=(rv in page),
                 )
             )
-
-
-def get_judges(judges=None, timeout=8, verify_ssl=False):
+        return self.is_working
+
+
+class JudgePool:
+    """Working judges of a checker by scheme.
+
+    Every checker has its own pool, so several brokers with different
+    judges can run in one process.
+    """
+
+    def __init__(self):
+        self.available = {'HTTP': [], 'HTTPS': [], 'SMTP': []}
+        # set when the first judge of the scheme is added, or when it's
+        # known that there are none
+        self.ev = {
+            'HTTP': asyncio.Event(),
+            'HTTPS': asyncio.Event(),
+            'SMTP': asyncio.Event(),
+        }
+
+    def add(self, judge):
+        self.available[judge.scheme].append(judge)
+        self.ev[judge.scheme].set()
+
+    def get_random(self, proto, exclude=None):
+        """Return a judge for the protocol, preferably a fast and healthy one.
+
+        The judges are chosen at random, weighted by the rate of checks
+        not failed by the judge divided by its own response time.
+        Evicted judges are skipped
+        unless all of them are evicted.
+
+        :param exclude: (optional) The judge that must not be chosen
+        :return: :class:`Judge` or None if there is no other judge
+        """
+        judges = [
+            j for j in self.available[get_scheme(proto)] if j is not exclude
+        ]
+        if not judges:
+            return None
+        candidates = [j for j in judges if not j.is_evicted] or judges
+        latencies = [j.latency for j in candidates if j.latency]
+        # the unmeasured judges are taken to be as fast as the average
+        default = sum(latencies) / len(latencies) if latencies else 1
+        weights = [
+            max(1 - j.error_rate, MIN_WEIGHT) / (j.latency or default)
+            for j in candidates
+        ]
+        point = random.uniform(0, sum(weights))
+        for judge, weight in zip(candidates, weights):
+            point -= weight
+            if point <= 0:
+                return judge
+        return candidates[-1]
+
+
+def get_scheme(proto):
+    """Return the scheme of the judges that check the protocol."""
+    if proto == 'HTTPS':
+        return 'HTTPS'
+    elif proto == 'CONNECT:25':
+        return 'SMTP'
+    return 'HTTP'
+
+
+def get_judges(judges=None, timeout=8, verify_ssl=False, connector=None):
     judges = judges or [
         'http://httpbin.org/get?show_env',
         'https://httpbin.org/get?show_env',
@@ -132,5 +246,6 @@ def get_judges(judges=None, timeout=8, verify_ssl=False):
         j = j if isinstance(j, Judge) else Judge(j)
         j.timeout = timeout
         j.verify_ssl = verify_ssl
+        j.connector = connector
         _judges.append(j)
     return _judges
@@ -0,0 +1,308 @@
+"""Metrics in the Prometheus text format.
+
+Metrics are module-level objects, so recording a value is only a dict
+lookup and an addition::
+
+    metrics.CHECKS.inc('HTTP', 'working')
+    metrics.CHECK_TIME.observe(0.35, 'HTTP')
+
+The values are exposed over HTTP by :class:`~proxybroker.server.Server`
+on ``/metrics``, or by :func:`start_server` on a separate port.
+"""
+
+import asyncio
+from bisect import bisect_left
+
+from .utils import log
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+
+
+class Metric:
+    """Base class of metrics.
+
+    :param str name: Name of the metric
+    :param str help: Description of the metric
+    :param tuple labels: (optional) Names of the labels
+    """
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # {label values: value}
+        self._values = {}
+
+    def get(self, *labels):
+        return self._values.get(labels, 0)
+
+    def clear(self):
+        self._values.clear()
+
+    def collect(self):
+        """Return the samples: [(name, {label: value}, value)]."""
+        return [
+            (self.name, dict(zip(self.labels, labels)), value)
+            for labels, value in sorted(self._values.items())
+        ]
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    type = 'counter'
+
+    def inc(self, *labels):
+        self._values[labels] = self._values.get(labels, 0) + 1
+
+    def add(self, amount, *labels):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down.
+
+    :param func:
+        (optional) Function called on collection instead of keeping
+        the values. Returns a number, or a dict {label values: value}
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=(), func=None):
+        super().__init__(name, help, labels)
+        self.func = func
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels):
+        self._values[labels] = self._values.get(labels, 0) + 1
+
+    def dec(self, *labels):
+        self._values[labels] = self._values.get(labels, 0) - 1
+
+    def collect(self):
+        if self.func is not None:
+            value = self.func()
+            self._values = value if isinstance(value, dict) else {(): value}
+        return super().collect()
+
+
+class Histogram(Metric):
+    """Distribution of values in buckets.
+
+    :param tuple buckets: (optional) Upper bounds of the buckets
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        # [count in each bucket (+Inf is the last), sum]
+        hist = self._values.get(labels)
+        if hist is None:
+            hist = self._values[labels] = [0] * (len(self.buckets) + 1) + [0]
+        hist[bisect_left(self.buckets, value)] += 1
+        hist[-1] += value
+
+    def get(self, *labels):
+        """Return the number of observed values."""
+        return sum(self._values.get(labels, [0])[:-1])
+
+    def collect(self):
+        samples = []
+        for labels, hist in sorted(self._values.items()):
+            _labels = dict(zip(self.labels, labels))
+            count = 0
+            for bound, num in zip(self.buckets + ('+Inf',), hist):
+                count += num
+                samples.append(
+                    (self.name + '_bucket', dict(_labels, le=bound), count)
+                )
+            samples.append((self.name + '_sum', _labels, hist[-1]))
+            samples.append((self.name + '_count', _labels, count))
+        return samples
+
+
+class Registry:
+    """Collection of metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def clear(self):
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def render(self):
+        """Return all metrics in the Prometheus text format.
+
+        :rtype: str
+        """
+        lines = []
+        for metric in self._metrics.values():
+            samples = metric.collect()
+            if not samples:
+                continue
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for name, labels, value in samples:
+                lines.append(
+                    '%s%s %s' % (name, _format_labels(labels), _format(value))
+                )
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, _format(v).replace('\\', r'\\').replace('"', r'\"'))
+        for k, v in labels.items()
+    )
+
+
+def _format(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+REGISTRY = Registry()
+
+CANDIDATES = REGISTRY.register(
+    Counter(
+        'proxybroker_candidates_total',
+        'Unique proxies received from providers',
+        ('provider',),
+    )
+)
+CHECKS_IN_FLIGHT = REGISTRY.register(
+    Gauge('proxybroker_checks_in_flight', 'Proxies being checked right now')
+)
+CHECKS = REGISTRY.register(
+    Counter(
+        'proxybroker_checks_total',
+        'Checks of proxies by protocol and result',
+        ('proto', 'result'),
+    )
+)
+CHECK_TIME = REGISTRY.register(
+    Histogram(
+        'proxybroker_check_duration_seconds',
+        'Duration of checks of proxies by protocol',
+        ('proto',),
+    )
+)
+JUDGE_TIME = REGISTRY.register(
+    Histogram(
+        'proxybroker_judge_duration_seconds',
+        'Response time of judges',
+        ('judge',),
+    )
+)
+JUDGE_EVICTIONS = REGISTRY.register(
+    Counter(
+        'proxybroker_judge_evictions_total',
+        'Judges evicted for failing the checks that pass with others',
+        ('judge',),
+    )
+)
+POOL_SIZE = REGISTRY.register(
+    Gauge(
+        'proxybroker_pool_proxies',
+        'Proxies in the pool of the server by scheme',
+        ('scheme',),
+    )
+)
+REQUESTS = REGISTRY.register(
+    Counter(
+        'proxybroker_server_requests_total',
+        'Requests handled by the server by scheme and result',
+        ('scheme', 'result'),
+    )
+)
+PROXY_ERRORS = REGISTRY.register(
+    Counter(
+        'proxybroker_proxy_errors_total',
+        'Errors of proxies (upstream errors) by type',
+        ('errmsg',),
+    )
+)
+RELAYED_BYTES = REGISTRY.register(
+    Counter(
+        'proxybroker_server_relayed_bytes_total',
+        'Bytes relayed by the server by direction',
+        ('direction',),
+    )
+)
+LOOP_LAG = REGISTRY.register(
+    Gauge(
+        'proxybroker_event_loop_lag_seconds',
+        'Delay of a timer callback in the event loop',
+    )
+)
+LOOP_BLOCKED = REGISTRY.register(
+    Counter(
+        'proxybroker_event_loop_blocked_seconds_total',
+        'Time the event loop was blocked by function',
+        ('function',),
+    )
+)
+
+
+def render():
+    """Return the metrics of :data:`REGISTRY` in the Prometheus format."""
+    return REGISTRY.render()
+
+
+def response(path):
+    """Return the HTTP response to a request of the metrics endpoint.
+
+    :rtype: bytes
+    """
+    if path.split('?', 1)[0] == '/metrics':
+        status, ctype, body = '200 OK', CONTENT_TYPE, render().encode()
+    else:
+        status, ctype, body = '404 Not Found', 'text/plain', b'Not Found\n'
+    head = (
+        'HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n'
+        'Connection: close\r\n\r\n' % (status, ctype, len(body))
+    )
+    return head.encode() + body
+
+
+async def _handle(reader, writer):
+    try:
+        line = await asyncio.wait_for(reader.readline(), timeout=5)
+        parts = line.decode('latin-1').split()
+        writer.write(response(parts[1] if len(parts) > 1 else ''))
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        log.debug('Metrics request is failed. Error: %r;' % e)
+    finally:
+        writer.close()
+
+
+async def start_server(host='127.0.0.1', port=9100, loop=None):
+    """Start a HTTP server that exposes the metrics on ``/metrics``.
+
+    :return: :class:`asyncio.AbstractServer`
+    """
+    srv = await asyncio.start_server(_handle, host=host, port=port, loop=loop)
+    log.info('Metrics are available on http://%s:%d/metrics' % (host, port))
+    return srv
@@ -0,0 +1,181 @@
+"""Monitor of the event loop lag and of slow callbacks.
+
+A heartbeat task measures how late the loop wakes it up. Optionally,
+a watchdog thread samples the stack of the loop thread while the loop
+is blocked and attributes the stall to the responsible function.
+
+If a monitor is started with ``discount_lag``, :meth:`Proxy.log`
+subtracts the lag measured during a request from its runtime, so a stall
+of the loop is not counted as a slow response of the proxy.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from . import metrics
+from .utils import log
+
+LAG_INTERVAL = 0.5  # seconds between the heartbeats
+MAX_BEATS = 1200  # heartbeats kept to discount the lag from runtimes
+MAX_STALLS = 10  # functions listed in the summary on stop
+
+_FILENAME = os.path.abspath(__file__)
+_PACKAGE_DIR = os.path.dirname(_FILENAME)
+_current = None  # the running monitor
+
+
+class LoopMonitor:
+    """Monitor of the event loop.
+
+    :param float interval:
+        (optional) Seconds between the heartbeats of the loop
+    :param float slow_callback:
+        (optional) Report the functions that block the loop longer than
+        this number of seconds. Disabled by default
+    :param bool discount_lag:
+        (optional) Flag indicating whether to subtract the lag from the
+        runtimes of proxies (see :func:`get_lag`)
+    :param loop: (optional) asyncio compatible event loop
+    """
+
+    def __init__(
+        self,
+        interval=LAG_INTERVAL,
+        slow_callback=None,
+        discount_lag=False,
+        loop=None,
+    ):
+        self._interval = interval
+        self._slow_callback = slow_callback
+        self.discount_lag = discount_lag
+        self._loop = loop or asyncio.get_event_loop()
+        # [(time.time() of the heartbeat, lag)]
+        self._beats = deque(maxlen=MAX_BEATS)
+        self._last_beat = None
+        self._task = None
+        self._thread = None
+        self._thread_id = None
+        self._stopped = threading.Event()
+        # {'module.function': seconds of blocking}
+        self.stalls = Counter()
+
+    def start(self):
+        """Start the monitor in the thread of the loop.
+
+        :return: self
+        """
+        global _current
+        self._thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.ensure_future(self._heartbeat(), loop=self._loop)
+        if self._slow_callback:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._watch, name='proxybroker-watchdog', daemon=True
+            )
+            self._thread.start()
+        _current = self
+        return self
+
+    def stop(self):
+        global _current
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._thread:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        if _current is self:
+            _current = None
+        if self.stalls:
+            log.info(
+                'Event loop was blocked by: %s'
+                % ', '.join(
+                    '%s (%.2fs)' % stall
+                    for stall in self.stalls.most_common(MAX_STALLS)
+                )
+            )
+
+    def get_lag(self, since, until=None):
+        """Return the lag of the loop in seconds between the two moments.
+
+        :param float since: Start, in seconds since the epoch
+        :param float until: (optional) End, the current time by default
+        """
+        until = until or time.time()
+        lag = 0
+        # the loop was blocked during the (lag) seconds before the beat
+        for btime, blag in reversed(self._beats):
+            if btime - blag >= until:
+                continue
+            if btime <= since:
+                break
+            lag += min(btime, until) - max(btime - blag, since)
+        return lag
+
+    async def _heartbeat(self):
+        while True:
+            stime = self._loop.time()
+            await asyncio.sleep(self._interval)
+            lag = max(self._loop.time() - stime - self._interval, 0)
+            self._last_beat = time.monotonic()
+            if lag:
+                self._beats.append((time.time(), lag))
+            metrics.LOOP_LAG.set(lag)
+
+    def _watch(self):
+        period = self._slow_callback / 2
+        reported = None
+        while not self._stopped.wait(period):
+            last_beat = self._last_beat
+            blocked = time.monotonic() - last_beat - self._interval
+            if blocked < self._slow_callback:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            where = _get_culprit(frame)
+            self.stalls[where] += period
+            metrics.LOOP_BLOCKED.add(period, where)
+            if reported != last_beat:
+                reported = last_beat
+                log.warning(
+                    'Event loop is blocked for %.2fs in %s'
+                    % (blocked, where)
+                )
+
+
+def _get_culprit(frame):
+    """Return the innermost function of proxybroker in the stack."""
+    innermost = frame
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(_PACKAGE_DIR) and filename != _FILENAME:
+            break
+        frame = frame.f_back
+    frame = frame or innermost
+    return '%s.%s' % (
+        frame.f_globals.get('__name__', '?'),
+        frame.f_code.co_name,
+    )
+
+
+def get_current():
+    """Return the running :class:`LoopMonitor` or None."""
+    return _current
+
+
+def get_lag(since, until=None):
+    """Return the lag to subtract from the runtime of a request.
+
+    0 if there is no running monitor or it doesn't discount the lag.
+    See :meth:`LoopMonitor.get_lag`.
+    """
+    if _current is None or not _current.discount_lag:
+        return 0
+    return _current.get_lag(since, until)
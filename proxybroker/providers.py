@@ -1,5 +1,10 @@
 import asyncio
+import copy
+import hashlib
+import json
+import os
 import re
+import time
 import warnings
 from base64 import b64decode
 from html import unescape
@@ -9,7 +14,81 @@ from urllib.parse import unquote, urlparse
 import aiohttp
 
 from .errors import BadStatusError
-from .utils import IPPattern, IPPortPatternGlobal, get_headers, log
+from .utils import IPPattern, IPPortTokenizer, get_headers, log
+
+
+class PageParser:
+    """Runs :meth:`Provider.find_proxies` in a pool of workers.
+
+    Heavy pages are parsed outside of the event loop, so the parsing
+    does not delay the checks of proxies and the local proxy server.
+
+    :param executor:
+        :class:`concurrent.futures.ThreadPoolExecutor` or
+        :class:`concurrent.futures.ProcessPoolExecutor`
+    :param int max_pending:
+        (optional) The maximum number of pages submitted to the executor.
+        Other pages wait for a free slot. By default twice the number of CPUs
+    """
+
+    def __init__(self, executor, max_pending=None, loop=None):
+        self._executor = executor
+        self._loop = loop or asyncio.get_event_loop()
+        self._sem = asyncio.Semaphore(max_pending or (os.cpu_count() or 1) * 2)
+
+    async def parse(self, provider, page):
+        async with self._sem:
+            return await self._loop.run_in_executor(
+                self._executor, provider.find_proxies, page
+            )
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class PageStore:
+    """Records pages of providers to a directory and replays them.
+
+    Pages are saved as JSON files, one per request, in a subdirectory
+    named after the domain of the provider. Replayed pages allow to test
+    and benchmark the parsing of providers without access to the network.
+
+    :param str path: Directory with recorded pages
+    :param bool replay:
+        (optional) Flag indicating whether to return the recorded pages
+        instead of sending requests. If False, received pages are recorded
+    """
+
+    def __init__(self, path, replay=False):
+        self.path = path
+        self.replay = replay
+
+    def _get_path(self, provider, url, data, method):
+        key = '%s %s %s' % (method, url, json.dumps(data, sort_keys=True))
+        name = hashlib.sha1(key.encode()).hexdigest() + '.json'
+        return os.path.join(self.path, provider.domain, name)
+
+    def load(self, provider, url, data=None, method='GET'):
+        path = self._get_path(provider, url, data, method)
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)['page']
+        except (OSError, ValueError, KeyError) as e:
+            log.debug('%s is not recorded. Error: %r;' % (url, e))
+            return ''
+
+    def save(self, provider, url, page, data=None, method='GET'):
+        path = self._get_path(provider, url, data, method)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        record = {
+            'provider': provider.__class__.__name__,
+            'method': method,
+            'url': url,
+            'data': data,
+            'page': page,
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
 
 
 class Provider:
@@ -27,26 +106,104 @@ class Provider:
         (optional) The maximum number of attempts to receive response
     :param int timeout:
         (optional) Timeout of a request in seconds
+    :param connector:
+        (optional) :class:`aiohttp.TCPConnector` shared with other providers.
+        If not set, every call of :meth:`.get_proxies` opens a new one
+    :param parser:
+        (optional) :class:`PageParser` to parse pages outside of the event
+        loop. If not set, pages are parsed in the event loop
+    :param store:
+        (optional) :class:`PageStore` to record received pages or to
+        replay them instead of sending requests
     """
 
-    _pattern = IPPortPatternGlobal
+    _pattern = IPPortTokenizer()
 
     def __init__(
-        self, url=None, proto=(), max_conn=4, max_tries=3, timeout=20, loop=None
+        self,
+        url=None,
+        proto=(),
+        max_conn=4,
+        max_tries=3,
+        timeout=20,
+        connector=None,
+        parser=None,
+        store=None,
+        loop=None,
     ):
         if url:
             self.domain = urlparse(url).netloc
         self.url = url
         self.proto = proto
+        self._max_conn = max_conn
         self._max_tries = max_tries
         self._timeout = timeout
+        self.connector = connector
+        self.parser = parser
+        self.store = store
+        self._init_state(loop)
+
+    def _init_state(self, loop=None):
         self._session = None
         self._cookies = {}
         self._proxies = set()
+        self.stat = {
+            'runs': 0,  # calls of get_proxies
+            'runtime': 0,  # time spent in get_proxies
+            'pages': 0,  # successfully fetched pages
+            'errors': 0,  # failed requests
+            'bytes': 0,
+            'fetch_time': 0,  # time spent on fetching of pages (with queuing)
+            'parse_time': 0,  # time spent in find_proxies
+            'unchanged': 0,  # pages skipped as parsed in the previous cycle
+            'received': 0,  # found proxies (candidates)
+            'unique': 0,  # found proxies, not found by other providers before
+            'working': 0,  # found proxies passed the checks
+        }
+        # validators (ETag, Last-Modified) and body of the last response
+        # for conditional requests: {url: (headers, page)}
+        self._cache = {}
+        # hashes of the pages parsed in the previous cycle: {request: hash}
+        self._page_hashes = {}
         # concurrent connections on the current provider
-        self._sem_provider = asyncio.Semaphore(max_conn)
+        self._sem_provider = asyncio.Semaphore(self._max_conn)
+        # some providers keep the state of parsing in their attributes,
+        # so pages of one provider are parsed one by one in the workers
+        self._parse_lock = asyncio.Lock()
         self._loop = loop or asyncio.get_event_loop()
 
+    def clone(self, connector=None, parser=None, store=None, loop=None):
+        """Return a copy of the provider with its own state.
+
+        The copy has its own statistics, cache of pages, session and
+        limits, so the same provider (e.g. of :data:`PROVIDERS`) can be
+        used by several brokers at a time.
+        """
+        clone = copy.copy(self)
+        clone.connector = connector
+        clone.parser = parser
+        clone.store = store
+        clone._init_state(loop)
+        return clone
+
+    def __getstate__(self):
+        # only the state required by find_proxies is sent to a worker process
+        state = self.__dict__.copy()
+        for attr in (
+            '_loop',
+            '_session',
+            '_sem_provider',
+            '_parse_lock',
+            'connector',
+            'parser',
+            'store',
+            '_proxies',
+            '_cache',
+            '_page_hashes',
+        ):
+            state.pop(attr, None)
+        return state
+
     @property
     def proxies(self):
         """Return all found proxies.
@@ -73,12 +230,19 @@ class Provider:
         :return: :attr:`.proxies`
         """
         log.debug('Try to get proxies from %s' % self.domain)
+        stime = time.time()
 
         async with aiohttp.ClientSession(
-            headers=get_headers(), cookies=self._cookies, loop=self._loop
+            headers=get_headers(),
+            cookies=self._cookies,
+            connector=self.connector,
+            connector_owner=self.connector is None,
+            loop=self._loop,
         ) as self._session:
             await self._pipe()
 
+        self.stat['runs'] += 1
+        self.stat['runtime'] += time.time() - stime
         log.debug(
             '%d proxies received from %s: %s'
             % (len(self.proxies), self.domain, self.proxies)
@@ -103,38 +267,90 @@ class Provider:
 
     async def _find_on_page(self, url, data=None, headers=None, method='GET'):
         page = await self.get(url, data=data, headers=headers, method=method)
+        if self._is_parsed(page, url, data, method):
+            log.debug('%s has not changed since the last cycle' % url)
+            self.stat['unchanged'] += 1
+            return
         oldcount = len(self.proxies)
         try:
-            received = self.find_proxies(page)
+            received = await self._parse(page)
         except Exception as e:
             received = []
             log.error(
                 'Error when executing find_proxies.'
                 'Domain: %s; Error: %r' % (self.domain, e)
             )
+        else:
+            # the page is skipped next time only if it has been parsed
+            self._set_parsed(page, url, data, method)
         self.proxies = received
+        self.stat['received'] += len(received)
         added = len(self.proxies) - oldcount
         log.debug(
             '%d(%d) proxies added(received) from %s'
             % (added, len(received), url)
         )
 
+    async def _parse(self, page):
+        stime = time.time()
+        try:
+            if self.parser is None:
+                return self.find_proxies(page)
+            async with self._parse_lock:
+                return await self.parser.parse(self, page)
+        finally:
+            self.stat['parse_time'] += time.time() - stime
+
+    def _is_parsed(self, page, url, data=None, method='GET'):
+        """Check that the page was already parsed in the previous cycle.
+
+        Found proxies are accumulated in :attr:`.proxies`, so there is no
+        reason to run :meth:`.find_proxies` on the same page again.
+        """
+        if not page:
+            return False
+        return self._page_hashes.get((method, url, repr(data))) == hash(page)
+
+    def _set_parsed(self, page, url, data=None, method='GET'):
+        """Remember the parsed page to skip it until it changes."""
+        if page:
+            self._page_hashes[(method, url, repr(data))] = hash(page)
+
     async def get(self, url, data=None, headers=None, method='GET'):
+        if self.store and self.store.replay:
+            stime = time.time()
+            page = self.store.load(self, url, data=data, method=method)
+            if page:
+                self._update_stat(stime, len(page.encode()))
+            else:
+                self.stat['errors'] += 1
+            return page
         for _ in range(self._max_tries):
             page = await self._get(
                 url, data=data, headers=headers, method=method
             )
             if page:
                 break
+        if page and self.store:
+            self.store.save(self, url, page, data=data, method=method)
         return page
 
     async def _get(self, url, data=None, headers=None, method='GET'):
         page = ''
+        stime = time.time()
+        cached = self._cache.get(url) if method == 'GET' else None
+        if cached:
+            headers = dict(headers or {}, **cached[0])
         try:
             timeout = aiohttp.ClientTimeout(total=self._timeout)
             async with self._sem_provider, self._session.request(
                 method, url, data=data, headers=headers, timeout=timeout
             ) as resp:
+                if cached and resp.status == 304:
+                    log.debug('%s is not modified' % url)
+                    self._update_stat(stime)
+                    return cached[1]
+                body = await resp.read()
                 page = await resp.text()
                 if resp.status != 200:
                     log.debug(
@@ -142,6 +358,9 @@ class Provider:
                         % (url, resp.headers, resp.cookies, page)
                     )
                     raise BadStatusError('Status: %s' % resp.status)
+                if method == 'GET':
+                    self._update_cache(url, resp.headers, page)
+                self._update_stat(stime, len(body))
         except (
             UnicodeDecodeError,
             BadStatusError,
@@ -151,9 +370,26 @@ class Provider:
             aiohttp.ServerDisconnectedError,
         ) as e:
             page = ''
+            self.stat['errors'] += 1
             log.debug('%s is failed. Error: %r;' % (url, e))
         return page
 
+    def _update_stat(self, stime, size=0):
+        self.stat['pages'] += 1
+        self.stat['bytes'] += size
+        self.stat['fetch_time'] += time.time() - stime
+
+    def _update_cache(self, url, headers, page):
+        validators = {}
+        if headers.get('ETag'):
+            validators['If-None-Match'] = headers['ETag']
+        if headers.get('Last-Modified'):
+            validators['If-Modified-Since'] = headers['Last-Modified']
+        if validators:
+            self._cache[url] = (validators, page)
+        else:
+            self._cache.pop(url, None)
+
     def find_proxies(self, page):
         return self._find_proxies(page)
 
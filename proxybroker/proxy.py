@@ -1,9 +1,12 @@
 import asyncio
+import copy
+import functools
 import ssl as _ssl
 import time
 import warnings
 from collections import Counter
 
+from . import metrics, monitor, tracing
 from .errors import (
     ProxyConnError,
     ProxyEmptyRecvError,
@@ -14,10 +17,11 @@ from .errors import (
 )
 from .negotiators import NGTRS
 from .resolver import Resolver
-from .utils import log, parse_headers
+from .utils import HeaderView, log
 
 _HTTP_PROTOS = {'HTTP', 'CONNECT:80', 'SOCKS4', 'SOCKS5'}
 _HTTPS_PROTOS = {'HTTPS', 'SOCKS4', 'SOCKS5'}
+BODY_CHUNK_SIZE = 2 ** 16  # bytes passed to the feed of recv() at once
 
 
 class Proxy:
@@ -57,7 +61,9 @@ class Proxy:
         loop = kwargs.pop('loop', None)
         resolver = kwargs.pop('resolver', Resolver(loop=loop))
         try:
-            _host = await resolver.resolve(host)
+            # the address is formatted by the tracer, if there is one
+            with tracing.span('resolve', proxy=host, port=args[0]):
+                _host = await resolver.resolve(host)
             self = cls(_host, *args, **kwargs)
         except (ResolveError, ValueError) as e:
             log.error('%s:%s: Error at creating: %s' % (host, args[0], e))
@@ -93,8 +99,11 @@ class Proxy:
         self._types = {}
         self._is_working = False
         self.stat = {'requests': 0, 'errors': Counter()}
+        # the provider where the proxy was found
+        self.provider = None
         self._ngtr = None
-        self._geo = Resolver.get_ip_info(self.host)
+        with tracing.span('geo', proxy=self):
+            self._geo = Resolver.get_ip_info(self.host)
         self._log = []
         self._runtimes = []
         self._schemes = ()
@@ -262,6 +271,9 @@ class Proxy:
     def log(self, msg, stime=0, err=None):
         ngtr = self.ngtr.name if self.ngtr else 'INFO'
         runtime = time.time() - stime if stime else 0
+        if runtime:
+            # stalls of the event loop are not the slowness of the proxy
+            runtime = max(runtime - monitor.get_lag(stime), 0)
         log.debug(
             '{h}:{p} [{n}]: {msg}; Runtime: {rt:.2f}'.format(
                 h=self.host, p=self.port, n=ngtr, msg=msg, rt=runtime
@@ -272,6 +284,7 @@ class Proxy:
         self._log.append((ngtr, msg, runtime))
         if err:
             self.stat['errors'][err.errmsg] += 1
+            metrics.PROXY_ERRORS.inc(err.errmsg)
         if runtime and 'timeout' not in msg:
             self._runtimes.append(runtime)
 
@@ -285,43 +298,58 @@ class Proxy:
         """
         return self._log
 
+    def clone(self):
+        """Return a copy of the proxy for a new connection.
+
+        The copy shares the types, statistics and log with the original,
+        so several connections can be open through the proxy at a time.
+        """
+        clone = copy.copy(self)
+        clone._ngtr = None
+        clone._closed = True
+        clone._reader = {'conn': None, 'ssl': None}
+        clone._writer = {'conn': None, 'ssl': None}
+        return clone
+
     async def connect(self, ssl=False):
-        err = None
-        msg = '%s' % 'SSL: ' if ssl else ''
-        stime = time.time()
-        self.log('%sInitial connection' % msg)
-        try:
-            if ssl:
-                _type = 'ssl'
-                sock = self._writer['conn'].get_extra_info('socket')
-                params = {
-                    'ssl': self._ssl_context,
-                    'sock': sock,
-                    'server_hostname': self.host,
-                }
+        with tracing.span('connect', proxy=self, ssl=ssl):
+            err = None
+            msg = '%s' % 'SSL: ' if ssl else ''
+            stime = time.time()
+            self.log('%sInitial connection' % msg)
+            try:
+                if ssl:
+                    _type = 'ssl'
+                    sock = self._writer['conn'].get_extra_info('socket')
+                    params = {
+                        'ssl': self._ssl_context,
+                        'sock': sock,
+                        'server_hostname': self.host,
+                    }
+                else:
+                    _type = 'conn'
+                    params = {'host': self.host, 'port': self.port}
+                conn = await asyncio.wait_for(
+                    asyncio.open_connection(**params), timeout=self._timeout
+                )
+                self._reader[_type], self._writer[_type] = conn
+            except asyncio.TimeoutError:
+                msg += 'Connection: timeout'
+                err = ProxyTimeoutError(msg)
+                raise err
+            except (ConnectionRefusedError, OSError, _ssl.SSLError):
+                msg += 'Connection: failed'
+                err = ProxyConnError(msg)
+                raise err
+            # except asyncio.CancelledError:
+            #     log.debug('Cancelled in proxy.connect()')
+            #     raise ProxyConnError()
             else:
-                _type = 'conn'
-                params = {'host': self.host, 'port': self.port}
-            self._reader[_type], self._writer[_type] = await asyncio.wait_for(
-                asyncio.open_connection(**params), timeout=self._timeout
-            )
-        except asyncio.TimeoutError:
-            msg += 'Connection: timeout'
-            err = ProxyTimeoutError(msg)
-            raise err
-        except (ConnectionRefusedError, OSError, _ssl.SSLError):
-            msg += 'Connection: failed'
-            err = ProxyConnError(msg)
-            raise err
-        # except asyncio.CancelledError:
-        #     log.debug('Cancelled in proxy.connect()')
-        #     raise ProxyConnError()
-        else:
-            msg += 'Connection: success'
-            self._closed = False
-        finally:
-            self.stat['requests'] += 1
-            self.log(msg, stime, err=err)
+                msg += 'Connection: success'
+                self._closed = False
+            finally:
+                self.stat['requests'] += 1
+                self.log(msg, stime, err=err)
 
     def close(self):
         if self._closed:
@@ -339,67 +367,135 @@ class Proxy:
         self._ngtr = None
 
     async def send(self, req):
-        msg, err = '', None
-        _req = req.encode() if not isinstance(req, bytes) else req
-        try:
-            self.writer.write(_req)
-            await self.writer.drain()
-        except ConnectionResetError:
-            msg = '; Sending: failed'
-            err = ProxySendError(msg)
-            raise err
-        finally:
-            self.log('Request: %s%s' % (req, msg), err=err)
-
-    async def recv(self, length=0, head_only=False):
-        resp, msg, err = b'', '', None
-        stime = time.time()
-        try:
-            resp = await asyncio.wait_for(
-                self._recv(length, head_only), timeout=self._timeout
-            )
-        except asyncio.TimeoutError:
-            msg = 'Received: timeout'
-            err = ProxyTimeoutError(msg)
-            raise err
-        except (ConnectionResetError, OSError):
-            msg = 'Received: failed'  # (connection is reset by the peer)
-            err = ProxyRecvError(msg)
-            raise err
-        else:
-            msg = 'Received: %s bytes' % len(resp)
-            if not resp:
-                err = ProxyEmptyRecvError(msg)
+        with tracing.span('send', proxy=self):
+            msg, err = '', None
+            _req = req.encode() if not isinstance(req, bytes) else req
+            try:
+                self.writer.write(_req)
+                await self.writer.drain()
+            except ConnectionResetError:
+                msg = '; Sending: failed'
+                err = ProxySendError(msg)
+                raise err
+            finally:
+                self.log('Request: %s%s' % (req, msg), err=err)
+
+    async def recv(self, length=0, head_only=False, feed=None):
+        """Receive a response from the proxy.
+
+        :param int length: (optional) Read exactly this number of bytes
+        :param bool head_only: (optional) Do not read the body
+        :param feed:
+            (optional) Function that takes the headers and a part of the
+            body (without the chunked framing) instead of the body being
+            added to the response. Receiving stops when it returns True
+        :return: The response
+        :rtype: bytes
+        """
+        with tracing.span('recv', proxy=self):
+            resp, msg, err = b'', '', None
+            stime = time.time()
+            try:
+                resp = await asyncio.wait_for(
+                    self._recv(length, head_only, feed), timeout=self._timeout
+                )
+            except asyncio.TimeoutError:
+                msg = 'Received: timeout'
+                err = ProxyTimeoutError(msg)
+                raise err
+            except (ConnectionResetError, OSError):
+                msg = 'Received: failed'  # (connection is reset by the peer)
+                err = ProxyRecvError(msg)
                 raise err
-        finally:
-            if resp:
-                msg += ': %s' % resp[:12]
-            self.log(msg, stime, err=err)
-        return resp
-
-    async def _recv(self, length=0, head_only=False):
-        resp = b''
+            else:
+                msg = 'Received: %s bytes' % len(resp)
+                if not resp:
+                    err = ProxyEmptyRecvError(msg)
+                    raise err
+            finally:
+                if resp:
+                    msg += ': %s' % resp[:12]
+                self.log(msg, stime, err=err)
+            return resp
+
+    async def _recv(self, length=0, head_only=False, feed=None):
         if length:
             try:
-                resp = await self.reader.readexactly(length)
+                return await self.reader.readexactly(length)
             except asyncio.IncompleteReadError as e:
-                resp = e.partial
+                return e.partial
+        # the response is read in one pass: the headers are parsed once
+        # and the body is taken by its size, nothing is read beyond it
+        resp = bytearray()
+        try:
+            resp += await self.reader.readuntil(b'\r\n\r\n')
+            if not head_only:
+                headers = HeaderView(resp)
+                put = feed and functools.partial(feed, headers)
+                await self._recv_body(resp, headers, put)
+        except asyncio.IncompleteReadError as e:
+            if feed is None:
+                resp += e.partial  # the connection is closed by the proxy
+        except asyncio.LimitOverrunError:
+            raise ProxyRecvError('Received: too long line')
+        return bytes(resp)
+
+    async def _recv_body(self, resp, headers, put=None):
+        # put() takes a part of the body and returns True to stop,
+        # without it the body is added to the response as is
+        status = headers.get('Status', 200)
+        if status in (204, 304) or 100 <= status < 200:
+            return
+        if headers.get('Transfer-Encoding') == 'chunked':
+            await self._recv_chunks(resp, put)
+        elif put is None:
+            if 'Content-Length' in headers:
+                size = int(headers['Content-Length'])
+                resp += await self.reader.readexactly(size)
+            else:  # the body ends with the connection
+                resp += await self.reader.read()
         else:
-            body_size, body_recv, chunked = 0, 0, None
-            while not self.reader.at_eof():
-                line = await self.reader.readline()
+            # without Content-Length the body ends with the connection
+            size = int(headers.get('Content-Length', -1))
+            while size:
+                data = await self.reader.read(
+                    BODY_CHUNK_SIZE if size < 0 else min(size, BODY_CHUNK_SIZE)
+                )
+                if not data or put(data):
+                    return
+                if size > 0:
+                    size -= len(data)
+
+    async def _recv_chunks(self, resp, put=None):
+        while True:
+            line = await self.reader.readuntil(b'\r\n')
+            if put is None:
+                resp += line
+            try:
+                size = int(line.split(b';', 1)[0], 16)
+            except ValueError:
+                # not a chunk size, so look for the last chunk line by line
+                while line and line != b'0\r\n':
+                    line = await self.reader.readline()
+                    if put is None:
+                        resp += line
+                    elif put(line):
+                        return
+                return
+            if not size:
+                break
+            if put is None:
+                resp += await self.reader.readexactly(size + 2)
+                continue
+            try:
+                data = await self.reader.readexactly(size + 2)
+            except asyncio.IncompleteReadError as e:
+                put(e.partial[:size])
+                return
+            if put(data[:-2]):
+                return
+        # the trailer ends with an empty line
+        while line != b'\r\n':
+            line = await self.reader.readuntil(b'\r\n')
+            if put is None:
                 resp += line
-                if body_size:
-                    body_recv += len(line)
-                    if body_recv >= body_size:
-                        break
-                elif chunked and line == b'0\r\n':
-                    break
-                elif not body_size and line == b'\r\n':
-                    if head_only:
-                        break
-                    headers = parse_headers(resp)
-                    body_size = int(headers.get('Content-Length', 0))
-                    if not body_size:
-                        chunked = headers.get('Transfer-Encoding') == 'chunked'
-        return resp
@@ -37,8 +37,9 @@ class Resolver:
         'http://ifconfig.io/ip',
     ]
 
-    def __init__(self, timeout=5, loop=None):
+    def __init__(self, timeout=5, connector=None, loop=None):
         self._timeout = timeout
+        self.connector = connector
         self._loop = loop or asyncio.get_event_loop()
         self._resolver = aiodns.DNSResolver(loop=self._loop)
 
@@ -95,7 +96,10 @@ class Resolver:
             try:
                 timeout = aiohttp.ClientTimeout(total=self._timeout)
                 async with aiohttp.ClientSession(
-                    timeout=timeout, loop=self._loop
+                    timeout=timeout,
+                    connector=self.connector,
+                    connector_owner=self.connector is None,
+                    loop=self._loop,
                 ) as session, session.get(self._pop_random_ip_host()) as resp:
                     ip = await resp.text()
             except asyncio.TimeoutError:
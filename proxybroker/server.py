@@ -1,7 +1,10 @@
 import asyncio
-import heapq
+import random
+import re
 import time
+from collections import OrderedDict, deque
 
+from . import metrics, tracing
 from .errors import (
     BadResponseError,
     BadStatusError,
@@ -10,40 +13,261 @@ from .errors import (
     NoProxyError,
     ProxyConnError,
     ProxyEmptyRecvError,
+    ProxyHedgeLostError,
     ProxyRecvError,
     ProxySendError,
     ProxyTimeoutError,
     ResolveError,
 )
 from .resolver import Resolver
-from .utils import log, parse_headers, parse_status_line
+from .utils import HeaderView, log, parse_status_line
 
 CONNECTED = b'HTTP/1.1 200 Connection established\r\n\r\n'
 
+# the delay of hedging is the percentile of the recent response times
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_METHODS = ('GET', 'HEAD')
+
+PROBE_PAUSE = 1  # seconds between the searches for idle proxies to probe
+PROBE_MAX_FAILS = 2  # proxy is evicted after failed probes in a row
+
+# states of the circuit breaker of proxy in the pool
+HEALTHY = 'healthy'
+QUARANTINED = 'quarantined'  # is not given to clients until the time is up
+HALF_OPEN = 'half-open'  # after the quarantine, one error sends it back
+EVICTED = 'evicted'
+
+STRATEGIES = ('best', 'p2c', 'least_outstanding', 'weighted')
+# the minimum weight of proxy in the ``weighted`` strategy (by error rate)
+MIN_WEIGHT = 0.05
+
+STICKY_MODES = ('client', 'header', 'host')
+MAX_STICKY = 10000  # the maximum number of pinned clients/hosts
+MAX_EVICTED = 10000  # the maximum number of remembered evicted proxies
+
 
 class ProxyPool:
-    """Imports and gives proxies from queue on demand."""
+    """Imports and gives proxies from queue on demand.
+
+    Proxies stay in the pool while they are in use. Every request gets
+    its own connection (see :meth:`Proxy.clone`), and the number of
+    requests in flight is tracked per proxy. A proxy is given to clients
+    while it has less than :attr:`max_inflight` requests in flight.
+    When all the proxies are busy, clients wait for a free one.
+
+    The proxy for a request is chosen by the :attr:`strategy`:
+
+    * ``best`` - the proxy with the lowest error rate and response time
+    * ``p2c`` - the less loaded of two random proxies (power of two choices)
+    * ``least_outstanding`` - the proxy with the fewest requests in flight
+    * ``weighted`` - random proxy, weighted by the inverse of response time
+
+    Every proxy has a circuit breaker. After :attr:`max_errors_in_row`
+    failed requests in a row the proxy is quarantined: it is not given
+    to clients for :attr:`quarantine_time` seconds, doubled on every next
+    quarantine. Then the proxy is half-open: one successful request makes
+    it healthy again, one failed request sends it back to quarantine.
+    After :attr:`max_quarantines` quarantines in a row the proxy is evicted.
+
+    Requests with the same affinity key (see :meth:`get`) are pinned
+    to one proxy for :attr:`sticky_ttl` seconds since the last request.
+    The pin is dropped when the proxy fails.
+    """
 
     def __init__(
-        self, proxies, min_req_proxy=5, max_error_rate=0.5, max_resp_time=8
+        self,
+        proxies,
+        min_req_proxy=5,
+        max_error_rate=0.5,
+        max_resp_time=8,
+        max_errors_in_row=3,
+        quarantine_time=30,
+        max_quarantines=3,
+        sticky_ttl=600,
+        strategy='best',
+        max_inflight=1,
     ):
+        if strategy not in STRATEGIES:
+            raise ValueError('`strategy` must be one of %s' % (STRATEGIES,))
         self._proxies = proxies
         self._pool = []
         self._min_req_proxy = min_req_proxy
         # if num of erros greater or equal 50% - proxy will be remove from pool
         self._max_error_rate = max_error_rate
         self._max_resp_time = max_resp_time
+        self._max_errors_in_row = max_errors_in_row
+        self._quarantine_time = quarantine_time
+        self._max_quarantines = max_quarantines
+        # {proxy: (state, errors in a row, quarantines in a row)}
+        self._states = {}
+        # {proxy: None}, least recently evicted first
+        self._evicted = OrderedDict()
+        # [(end of quarantine, proxy)]
+        self._quarantined = []
+        self._sticky_ttl = sticky_ttl
+        # {affinity key: (proxy, expiration time)}, least recently used first
+        self._pinned = OrderedDict()
+        self._strategy = strategy
+        self._max_inflight = max_inflight
+        # {proxy: number of requests in flight}
+        self._inflight = {}
+        # {connection: proxy}
+        self._conns = {}
+        self._released = asyncio.Event()
+        # function called with the proxy when it's evicted
+        self.on_evict = None
+
+    async def get(self, scheme, key=None):
+        """Return a connection to a proxy for the scheme.
 
-    async def get(self, scheme):
+        :param key:
+            (optional) Affinity key, for example the client address.
+            The requests with the same key get the same proxy while it is
+            working and not busy with other requests
+        """
         scheme = scheme.upper()
-        for priority, proxy in self._pool:
-            if scheme in proxy.schemes:
-                chosen = proxy
-                self._pool.remove((proxy.priority, proxy))
+        while True:
+            chosen = self.get_nowait(scheme, key)
+            if chosen is not None:
+                return chosen
+            # wait until a new proxy is found, a quarantine ends or
+            # a proxy is released or returned to the pool
+            self._released.clear()
+            released = asyncio.ensure_future(self._released.wait())
+            imported = asyncio.ensure_future(self._import(scheme))
+            done, pending = await asyncio.wait(
+                [released, imported],
+                timeout=self._get_quarantine_left(),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in pending:
+                task.cancel()
+            if imported in done:
+                proxy = imported.result()
                 break
-        else:
-            chosen = await self._import(scheme)
-        return chosen
+        self._pool.append(proxy)
+        if key is not None and not self._is_pinned(key):
+            self._pin(key, proxy)
+        return self._acquire(proxy)
+
+    def get_nowait(self, scheme, key=None):
+        """Return a connection to a proxy from the pool or None if there
+        is no suitable one.
+
+        Unlike :meth:`get`, does not wait for new proxies from the queue.
+        """
+        self._release_quarantined()
+        scheme = scheme.upper()
+        candidates = [
+            proxy
+            for proxy in self._pool
+            if scheme in proxy.schemes
+            and self._inflight.get(proxy, 0) < self._max_inflight
+        ]
+        if key is not None:
+            pinned = self._get_pinned(key, scheme, candidates)
+            if pinned:
+                return self._acquire(pinned)
+        if not candidates:
+            return None
+        proxy = self._select(candidates)
+        if key is not None and key not in self._pinned:
+            self._pin(key, proxy)
+        return self._acquire(proxy)
+
+    def get_sizes(self):
+        """Return the number of proxies in the pool by scheme.
+
+        :return: {(scheme,): number of proxies}
+        """
+        sizes = {('HTTP',): 0, ('HTTPS',): 0}
+        for proxy in self._pool:
+            for scheme in proxy.schemes:
+                sizes[(scheme,)] += 1
+        return sizes
+
+    def get_state(self, proxy):
+        """Return the state of the circuit breaker of proxy."""
+        proxy = self._conns.get(proxy, proxy)
+        if proxy in self._evicted:
+            return EVICTED
+        return self._states.get(proxy, (HEALTHY,))[0]
+
+    def get_inflight(self, proxy):
+        """Return the number of requests in flight through the proxy."""
+        proxy = self._conns.get(proxy, proxy)
+        return self._inflight.get(proxy, 0)
+
+    def _select(self, candidates):
+        inflight = self._inflight
+        if self._strategy == 'p2c' and len(candidates) > 1:
+            candidates = random.sample(candidates, 2)
+        if self._strategy in ('p2c', 'least_outstanding'):
+            return min(
+                candidates, key=lambda p: (inflight.get(p, 0), p.priority)
+            )
+        elif self._strategy == 'weighted':
+            weights = [
+                max(1 - p.error_rate, MIN_WEIGHT) / (p.avg_resp_time or 1)
+                for p in candidates
+            ]
+            point = random.uniform(0, sum(weights))
+            for proxy, weight in zip(candidates, weights):
+                point -= weight
+                if point <= 0:
+                    return proxy
+            return candidates[-1]
+        return min(candidates, key=lambda p: p.priority)
+
+    def _acquire(self, proxy):
+        self._inflight[proxy] = self._inflight.get(proxy, 0) + 1
+        conn = proxy.clone()
+        self._conns[conn] = proxy
+        return conn
+
+    def _get_pinned(self, key, scheme, candidates):
+        proxy, expires = self._pinned.get(key, (None, 0))
+        if not proxy:
+            return None
+        if expires < time.time() or scheme not in proxy.schemes:
+            del self._pinned[key]
+            return None
+        if proxy not in candidates:
+            return None  # busy with other requests, keep the pin
+        self._pin(key, proxy)
+        return proxy
+
+    def _is_pinned(self, key):
+        _, expires = self._pinned.get(key, (None, 0))
+        return expires >= time.time()
+
+    def _pin(self, key, proxy):
+        self._pinned[key] = (proxy, time.time() + self._sticky_ttl)
+        self._pinned.move_to_end(key)
+        if len(self._pinned) > MAX_STICKY:
+            self._pinned.popitem(last=False)
+
+    def _unpin(self, proxy):
+        for key in [k for k, (p, _) in self._pinned.items() if p is proxy]:
+            del self._pinned[key]
+
+    def _release_quarantined(self):
+        now = time.time()
+        for end, proxy in self._quarantined[:]:
+            if end <= now:
+                self._quarantined.remove((end, proxy))
+                _, errors, quarantines = self._states[proxy]
+                self._states[proxy] = (HALF_OPEN, errors, quarantines)
+                log.debug('%s:%d is half-open' % (proxy.host, proxy.port))
+                self._pool.append(proxy)
+                self._released.set()
+
+    def _get_quarantine_left(self):
+        if not self._quarantined:
+            return None
+        end = min(end for end, _ in self._quarantined)
+        return max(end - time.time(), 0)
 
     async def _import(self, expected_scheme):
         while True:
@@ -56,7 +280,54 @@ class ProxyPool:
             else:
                 return proxy
 
-    def put(self, proxy):
+    def take_idle(self, count, exclude=()):
+        """Take out of the pool up to ``count`` idle proxies to probe them.
+
+        Proxies that clients would get first are taken first, but at least
+        half of the idle proxies are always left for clients.
+        """
+        idle = [p for p in self._pool if not self._inflight.get(p)]
+        count = min(count, len(idle) // 2)
+        chosen = [
+            proxy
+            for proxy in sorted(idle, key=lambda p: p.priority)
+            if proxy not in exclude
+        ][:count]
+        for proxy in chosen:
+            self._pool.remove(proxy)
+        return chosen
+
+    def put(self, proxy, failed=False):
+        """Return the proxy or connection to the pool after a request.
+
+        :param bool failed: Flag indicating whether the request has failed
+            because of the proxy
+        """
+        conn, proxy = proxy, self._conns.pop(proxy, proxy)
+        if conn is not proxy:
+            self._inflight[proxy] -= 1
+            if not self._inflight[proxy]:
+                del self._inflight[proxy]
+            self._released.set()
+
+        if proxy in self._evicted:
+            # the result of a request started before the eviction
+            return
+        state, errors, quarantines = self._states.get(proxy, (HEALTHY, 0, 0))
+        if state == QUARANTINED:
+            # the result of a request started before the quarantine
+            return
+        if failed and self._pinned:
+            self._unpin(proxy)
+        if not failed:
+            state, errors, quarantines = HEALTHY, 0, 0
+        elif state == HALF_OPEN or errors + 1 >= self._max_errors_in_row:
+            self._quarantine(proxy, quarantines + 1)
+            return
+        else:
+            errors += 1
+        self._states[proxy] = (state, errors, quarantines)
+
         if proxy.stat['requests'] >= self._min_req_proxy and (
             (proxy.error_rate > self._max_error_rate)
             or (proxy.avg_resp_time > self._max_resp_time)
@@ -64,10 +335,56 @@ class ProxyPool:
             log.debug(
                 '%s:%d removed from proxy pool' % (proxy.host, proxy.port)
             )
-        else:
-            heapq.heappush(self._pool, (proxy.priority, proxy))
+            self.evict(proxy)
+        elif proxy not in self._pool:
+            self._pool.append(proxy)
+            self._released.set()
         log.debug('%s:%d stat: %s' % (proxy.host, proxy.port, proxy.stat))
 
+    def _quarantine(self, proxy, quarantines):
+        if quarantines > self._max_quarantines:
+            log.debug(
+                '%s:%d removed from proxy pool after %d quarantines'
+                % (proxy.host, proxy.port, quarantines - 1)
+            )
+            self.evict(proxy)
+            return
+        duration = self._quarantine_time * 2 ** (quarantines - 1)
+        self._states[proxy] = (QUARANTINED, 0, quarantines)
+        self._quarantined.append((time.time() + duration, proxy))
+        if proxy in self._pool:
+            self._pool.remove(proxy)
+        log.debug(
+            '%s:%d quarantined for %d seconds'
+            % (proxy.host, proxy.port, duration)
+        )
+
+    def evict(self, proxy):
+        """Remove the proxy from the pool for good.
+
+        Its pins are dropped, and :attr:`on_evict` is called with it.
+        """
+        # evicted proxies are remembered for the requests still in flight
+        self._states.pop(proxy, None)
+        self._evicted[proxy] = None
+        if len(self._evicted) > MAX_EVICTED:
+            self._evicted.popitem(last=False)
+        self._unpin(proxy)
+        self._quarantined = [q for q in self._quarantined if q[1] is not proxy]
+        if proxy in self._pool:
+            self._pool.remove(proxy)
+        if self.on_evict:
+            self.on_evict(proxy)
+
+
+def _remove_header(request, name):
+    """Return the request without the header, matched case-insensitively."""
+    head, sep, body = request.partition(b'\r\n\r\n')
+    pattern = re.compile(
+        br'\r\n' + re.escape(name.encode()) + br'[ \t]*:[^\r\n]*', re.I
+    )
+    return pattern.sub(b'', head) + sep + body
+
 
 class Server:
     """Server distributes incoming requests to a pool of found proxies."""
@@ -85,6 +402,17 @@ class Server:
         prefer_connect=False,
         http_allowed_codes=None,
         backlog=100,
+        hedge=False,
+        probe_interval=0,
+        max_probes=2,
+        max_errors_in_row=3,
+        quarantine_time=30,
+        max_quarantines=3,
+        sticky=None,
+        sticky_header='X-Proxy-Session',
+        sticky_ttl=600,
+        strategy='best',
+        max_inflight=1,
         loop=None,
         **kwargs
     ):
@@ -95,12 +423,37 @@ class Server:
         self._max_tries = max_tries
         self._backlog = backlog
         self._prefer_connect = prefer_connect
+        if sticky and sticky not in STICKY_MODES:
+            raise ValueError('`sticky` must be one of %s' % (STICKY_MODES,))
+        self._sticky = sticky
+        self._sticky_header = sticky_header.title()
+        self._hedge = hedge
+        # time to receive response headers of the recent hedged requests
+        self._resp_times = deque(maxlen=200)
+        # Checker to probe idle proxies in the pool, set by Broker.find
+        self.prober = None
+        self._probe_interval = probe_interval
+        self._max_probes = max_probes
+        self._probes = set()
+        # {proxy: (time of the last probe, number of failed probes in a row)}
+        self._probed = {}
+        self._probe_task = None
 
         self._server = None
         self._connections = {}
         self._proxy_pool = ProxyPool(
-            proxies, min_req_proxy, max_error_rate, max_resp_time
+            proxies,
+            min_req_proxy,
+            max_error_rate,
+            max_resp_time,
+            max_errors_in_row,
+            quarantine_time,
+            max_quarantines,
+            sticky_ttl,
+            strategy,
+            max_inflight,
         )
+        self._proxy_pool.on_evict = self._forget_probed
         self._resolver = Resolver(loop=self._loop)
         self._http_allowed_codes = http_allowed_codes or []
 
@@ -113,6 +466,9 @@ class Server:
             loop=self._loop,
         )
         self._server = self._loop.run_until_complete(srv)
+        metrics.POOL_SIZE.func = self._proxy_pool.get_sizes
+        if self._probe_interval:
+            self._probe_task = asyncio.ensure_future(self._probe_idle())
 
         log.info(
             'Listening established on {0}'.format(
@@ -126,6 +482,10 @@ class Server:
         for conn in self._connections:
             if not conn.done():
                 conn.cancel()
+        if self._probe_task:
+            self._probe_task.cancel()
+        for task in self._probes:
+            task.cancel()
         self._server.close()
         if not self._loop.is_running():
             self._loop.run_until_complete(self._server.wait_closed())
@@ -135,6 +495,49 @@ class Server:
         self._loop.stop()
         log.info('Server is stopped')
 
+    async def _probe_idle(self):
+        """Probe idle proxies in the pool before the clients get them.
+
+        Each proxy is probed at most once per :attr:`probe_interval`
+        seconds, no more than :attr:`max_probes` at a time, and probes
+        never take more than half of the idle proxies.
+        """
+        while True:
+            await asyncio.sleep(PROBE_PAUSE)
+            if not self.prober:
+                continue
+            now = time.time()
+            recent = {
+                proxy
+                for proxy, (ptime, _) in self._probed.items()
+                if now - ptime < self._probe_interval
+            }
+            for proxy in self._proxy_pool.take_idle(
+                self._max_probes - len(self._probes), exclude=recent
+            ):
+                task = asyncio.ensure_future(self._probe(proxy))
+                task.add_done_callback(self._probes.discard)
+                self._probes.add(task)
+
+    async def _probe(self, proxy):
+        _, fails = self._probed.get(proxy, (0, 0))
+        working = await self.prober.probe(proxy)
+        fails = 0 if working else fails + 1
+        if fails >= PROBE_MAX_FAILS:
+            log.debug(
+                '%s:%d removed from proxy pool: probe failed'
+                % (proxy.host, proxy.port)
+            )
+            self._proxy_pool.evict(proxy)
+            return
+        self._probed[proxy] = (time.time(), fails)
+        # errors of a failed probe are counted in the error rate of proxy,
+        # so it goes after the working ones or is removed by the pool
+        self._proxy_pool.put(proxy, failed=not working)
+
+    def _forget_probed(self, proxy):
+        self._probed.pop(proxy, None)
+
     def _accept(self, client_reader, client_writer):
         def _on_completion(f):
             reader, writer = self._connections.pop(f)
@@ -162,6 +565,11 @@ class Server:
         )
 
         request, headers = await self._parse_request(client_reader)
+        if headers['Method'] == 'GET' and headers['Path'].startswith('/'):
+            # not a proxy request, so it's addressed to the server itself
+            client_writer.write(metrics.response(headers['Path']))
+            await client_writer.drain()
+            return
         scheme = self._identify_scheme(headers)
         client = id(client_reader)
         log.debug(
@@ -169,48 +577,40 @@ class Server:
             % (client, request, headers, scheme)
         )
 
+        key = self._get_affinity_key(client_writer, headers)
+        if self._sticky == 'header':
+            # the session header is for the server, not for the proxies
+            request = _remove_header(request, self._sticky_header)
         for attempt in range(self._max_tries):
-            stime, err = 0, None
-            proxy = await self._proxy_pool.get(scheme)
+            stime, err, failed = 0, None, False
+            proxy = await self._proxy_pool.get(scheme, key)
             proto = self._choice_proto(proxy, scheme)
             log.debug(
                 'client: %d; attempt: %d; proxy: %s; proto: %s'
                 % (client, attempt, proxy, proto)
             )
             try:
-                await proxy.connect()
-
-                if proto in ('CONNECT:80', 'SOCKS4', 'SOCKS5'):
-                    host = headers.get('Host')
-                    port = headers.get('Port', 80)
-                    try:
-                        ip = await self._resolver.resolve(host)
-                    except ResolveError:
-                        return
-                    proxy.ngtr = proto
-                    await proxy.ngtr.negotiate(host=host, port=port, ip=ip)
-                    if scheme == 'HTTPS' and proto in ('SOCKS4', 'SOCKS5'):
-                        client_writer.write(CONNECTED)
-                        await client_writer.drain()
-                    else:  # HTTP
-                        await proxy.send(request)
-                else:  # proto: HTTP & HTTPS
-                    await proxy.send(request)
-
-                stime = time.time()
-                stream = [
-                    asyncio.ensure_future(
-                        self._stream(reader=client_reader, writer=proxy.writer)
-                    ),
-                    asyncio.ensure_future(
-                        self._stream(
-                            reader=proxy.reader,
-                            writer=client_writer,
-                            scheme=scheme,
-                        )
-                    ),
-                ]
-                await asyncio.gather(*stream, loop=self._loop)
+                if self._hedge and (
+                    scheme == 'HTTP' and headers['Method'] in HEDGE_METHODS
+                ):
+                    proxy, stime, head = await self._hedged_request(
+                        client, proxy, proto, headers, request
+                    )
+                    client_writer.write(head)
+                    # the response status is already checked
+                    await self._relay(
+                        client_reader, client_writer, proxy, scheme=None
+                    )
+                else:
+                    await self._send_request(
+                        proxy, proto, scheme, headers, request, client_writer
+                    )
+                    stime = time.time()
+                    await self._relay(
+                        client_reader, client_writer, proxy, scheme
+                    )
+            except ResolveError:
+                return
             except asyncio.CancelledError:
                 log.debug('Cancelled in server._handle')
                 break
@@ -224,21 +624,20 @@ class Server:
                 BadResponseError,
             ) as e:
                 log.debug('client: %d; error: %r' % (client, e))
+                failed = True
                 continue
             except ErrorOnStream as e:
                 log.debug(
                     'client: %d; error: %r; EOF: %s'
                     % (client, e, client_reader.at_eof())
                 )
-                for task in stream:
-                    if not task.done():
-                        task.cancel()
                 if client_reader.at_eof() and 'Timeout' in repr(e):
                     # Proxy may not be able to receive EOF and weel be raised a
                     # TimeoutError, but all the data has already successfully
                     # returned, so do not consider this error of proxy
                     break
                 err = e
+                failed = True
                 if scheme == 'HTTPS':  # SSL Handshake probably failed
                     break
             else:
@@ -246,11 +645,129 @@ class Server:
             finally:
                 proxy.log(request.decode(), stime, err=err)
                 proxy.close()
-                self._proxy_pool.put(proxy)
+                self._proxy_pool.put(proxy, failed=failed)
+                metrics.REQUESTS.inc(
+                    scheme, 'failed' if failed else 'success'
+                )
+
+    def _get_affinity_key(self, client_writer, headers):
+        if self._sticky == 'client':
+            peername = client_writer.get_extra_info('peername')
+            return peername[0] if peername else None
+        elif self._sticky == 'header':
+            return headers.get(self._sticky_header)
+        elif self._sticky == 'host':
+            return headers.get('Host')
+        return None
+
+    async def _send_request(
+        self, proxy, proto, scheme, headers, request, client_writer
+    ):
+        await proxy.connect()
+
+        if proto in ('CONNECT:80', 'SOCKS4', 'SOCKS5'):
+            host = headers.get('Host')
+            port = headers.get('Port', 80)
+            ip = await self._resolver.resolve(host)
+            proxy.ngtr = proto
+            with tracing.span('negotiate', proxy=proxy, proto=proto):
+                await proxy.ngtr.negotiate(host=host, port=port, ip=ip)
+            if scheme == 'HTTPS' and proto in ('SOCKS4', 'SOCKS5'):
+                client_writer.write(CONNECTED)
+                await client_writer.drain()
+            else:  # HTTP
+                await proxy.send(request)
+        else:  # proto: HTTP & HTTPS
+            await proxy.send(request)
+
+    async def _request_head(self, proxy, proto, headers, request):
+        """Send the HTTP request and receive the response headers."""
+        await self._send_request(proxy, proto, 'HTTP', headers, request, None)
+        stime = time.time()
+        head = await proxy.recv(head_only=True)
+        self._check_response(head, 'HTTP')
+        self._resp_times.append(time.time() - stime)
+        return stime, head
+
+    def _get_hedge_delay(self):
+        if len(self._resp_times) < HEDGE_MIN_SAMPLES:
+            return self._timeout / 2
+        times = sorted(self._resp_times)
+        return times[min(int(len(times) * HEDGE_PERCENTILE), len(times) - 1)]
+
+    async def _hedged_request(self, client, proxy, proto, headers, request):
+        """Send the request through a second proxy if the first is slow.
+
+        If the first proxy has not returned the response headers within
+        the 95th percentile of the recent response times, the same request
+        is sent through another proxy from the pool, and the first one that
+        answers is used. The other proxy is penalised and returned to the
+        pool here, the first proxy is returned to the pool by the caller
+        if neither has answered.
+
+        :return: The proxy, the time when the request was sent through it
+            and the response headers
+        """
+        tasks = {
+            asyncio.ensure_future(
+                self._request_head(proxy, proto, headers, request)
+            ): proxy
+        }
+        winner = None
+        try:
+            done, pending = await asyncio.wait(
+                list(tasks), timeout=self._get_hedge_delay()
+            )
+            second = self._proxy_pool.get_nowait('HTTP') if pending else None
+            if second:
+                log.debug('client: %d; hedged by: %s' % (client, second))
+                task = asyncio.ensure_future(
+                    self._request_head(
+                        second,
+                        self._choice_proto(second, 'HTTP'),
+                        headers,
+                        request,
+                    )
+                )
+                tasks[task] = second
+                pending.add(task)
+            while True:
+                for task in done:
+                    if not task.exception():
+                        winner = task
+                        break
+                if winner or not pending:
+                    break
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+        finally:
+            for task, _proxy in tasks.items():
+                if task is winner:
+                    continue
+                failed = False
+                if not task.done():
+                    task.cancel()
+                    if winner:
+                        _proxy.log(
+                            'Request: lost the hedged race',
+                            err=ProxyHedgeLostError(),
+                        )
+                else:
+                    failed = task.exception() is not None
+                if winner or _proxy is not proxy:
+                    _proxy.close()
+                    self._proxy_pool.put(_proxy, failed=failed)
+
+        if not winner:
+            first = next(iter(tasks))
+            raise first.exception()
+        stime, head = winner.result()
+        return tasks[winner], stime, head
 
     async def _parse_request(self, reader, length=65536):
         request = await reader.read(length)
-        headers = parse_headers(request)
+        headers = HeaderView(request)
         if headers['Method'] == 'POST' and request.endswith(b'\r\n\r\n'):
             # For aiohttp. POST data returns on second reading
             request += await reader.read(length)
@@ -279,13 +796,76 @@ class Server:
             proto = relevant.pop()
         return proto
 
-    async def _stream(self, reader, writer, length=65536, scheme=None):
+    async def _relay(self, client_reader, client_writer, proxy, scheme):
+        """Stream data between the client and the proxy in both directions.
+
+        The connection is closed by timeout only when neither side has
+        sent anything for :attr:`timeout` seconds, so the client that is
+        waiting for a long download is not considered as idle. Neither is
+        the slow client that is still reading the sent data.
+        """
+        # time of the last received or sent data and the number of streams
+        # waiting for the sent data to be read, updated by both streams
+        activity = [self._loop.time(), 0]
+        stream = [
+            asyncio.ensure_future(
+                self._stream(
+                    reader=client_reader,
+                    writer=proxy.writer,
+                    activity=activity,
+                    direction='upstream',
+                )
+            ),
+            asyncio.ensure_future(
+                self._stream(
+                    reader=proxy.reader,
+                    writer=client_writer,
+                    scheme=scheme,
+                    activity=activity,
+                    direction='downstream',
+                )
+            ),
+        ]
+        pending = stream
+        try:
+            while pending:
+                # one timer per idle period instead of one per read
+                if activity[1]:
+                    timeout = self._timeout
+                else:
+                    timeout = activity[0] + self._timeout - self._loop.time()
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(timeout, 0),
+                    return_when=asyncio.FIRST_EXCEPTION,
+                )
+                for task in done:
+                    task.result()  # raises ErrorOnStream
+                if (
+                    pending
+                    and not activity[1]
+                    and self._loop.time() - activity[0] >= self._timeout
+                ):
+                    raise ErrorOnStream(asyncio.TimeoutError())
+        finally:
+            for task in stream:
+                if not task.done():
+                    task.cancel()
+
+    async def _stream(
+        self,
+        reader,
+        writer,
+        activity,
+        length=65536,
+        scheme=None,
+        direction='downstream',
+    ):
         checked = False
         try:
             while not reader.at_eof():
-                data = await asyncio.wait_for(
-                    reader.read(length), self._timeout
-                )
+                data = await reader.read(length)
+                activity[0] = self._loop.time()
                 if not data:
                     writer.close()
                     break
@@ -293,7 +873,13 @@ class Server:
                     self._check_response(data, scheme)
                     checked = True
                 writer.write(data)
-                await writer.drain()
+                metrics.RELAYED_BYTES.add(len(data), direction)
+                activity[1] += 1
+                try:
+                    await writer.drain()
+                finally:
+                    activity[1] -= 1
+                activity[0] = self._loop.time()
         except (
             asyncio.TimeoutError,
             ConnectionResetError,
@@ -0,0 +1,173 @@
+"""Tracing of the check pipeline.
+
+The stages of a check (resolving, waiting in the queue, connecting,
+negotiating, sending, receiving, etc.) are wrapped in spans::
+
+    with tracing.span('connect', proxy=proxy, proto='HTTP'):
+        ...
+
+Spans are not recorded until a tracer is installed, and then every
+finished span is passed to it::
+
+    tracer = ChromeTracer('trace.json')
+    tracing.set_tracer(tracer)
+    ...
+    tracer.close()
+
+The file of :class:`ChromeTracer` is opened in ``chrome://tracing`` or
+https://ui.perfetto.dev as a flame chart with a row per proxy.
+"""
+
+import json
+import os
+import time
+
+_tracer = None  # the installed tracer
+
+
+class Span:
+    """A timed stage of the pipeline.
+
+    :param str name: Name of the stage
+    :param dict attrs: Attributes, e.g. ``proxy`` and ``proto``;
+        ``proxy`` is a :class:`Proxy` or a host with the ``port``
+    """
+
+    __slots__ = ('name', 'attrs', 'start', 'end', '_tracer')
+
+    def __init__(self, tracer, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = self.end = None
+        self._tracer = tracer
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self._tracer.on_start(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self._tracer.on_end(self)
+        return False
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Base class of tracers.
+
+    Subclasses override :meth:`on_start` and/or :meth:`on_end`.
+    """
+
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        pass
+
+    def close(self):
+        pass
+
+
+class ChromeTracer(Tracer):
+    """Write spans to a file in the Chrome trace event format.
+
+    Spans of one proxy are shown in one row (thread) of the chart.
+
+    :param str path: Path to the trace file
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'w')
+        # the closing bracket is optional in the JSON array format,
+        # so events are written as they come
+        self._file.write('[')
+        self._sep = '\n'
+        self._pid = os.getpid()
+        # {row: tid}
+        self._rows = {}
+
+    def on_end(self, span):
+        attrs = dict(span.attrs)
+        tid = self._get_tid(attrs.pop('proxy', None), attrs.pop('port', None))
+        self._write(
+            {
+                'name': span.name,
+                'cat': 'proxybroker',
+                'ph': 'X',
+                'ts': span.start * 1e6,
+                'dur': span.duration * 1e6,
+                'pid': self._pid,
+                'tid': tid,
+                'args': {k: str(v) for k, v in attrs.items()},
+            }
+        )
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.write('\n]\n')
+        self._file.close()
+
+    def _get_tid(self, proxy, port=None):
+        if proxy is None:
+            row = 'broker'
+        elif isinstance(proxy, str):  # the host of a proxy being created
+            row = '%s:%s' % (proxy, port)
+        else:
+            row = '%s:%d' % (proxy.host, proxy.port)
+        tid = self._rows.get(row)
+        if tid is None:
+            tid = self._rows[row] = len(self._rows) + 1
+            self._write(
+                {
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': self._pid,
+                    'tid': tid,
+                    'args': {'name': row},
+                }
+            )
+        return tid
+
+    def _write(self, event):
+        self._file.write(self._sep + json.dumps(event))
+        self._sep = ',\n'
+
+
+def set_tracer(tracer):
+    """Install the tracer; None disables tracing."""
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, **attrs):
+    """Return a context manager that times a stage of the pipeline.
+
+    Without a tracer the same no-op object is returned every time.
+    """
+    if _tracer is None:
+        return _NOOP_SPAN
+    return Span(_tracer, name, attrs)
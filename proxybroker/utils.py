@@ -9,6 +9,7 @@ import shutil
 import tarfile
 import tempfile
 import urllib.request
+from collections.abc import Mapping
 
 from . import __version__ as version
 from .errors import BadStatusLine
@@ -32,6 +33,64 @@ IPPortPatternGlobal = re.compile(
     flags=re.DOTALL,
 )
 
+PortPattern = re.compile(r'\d{2,5}')
+
+# A cheap superset of IPPattern: each IP address also matches this pattern
+IPCandidatePattern = re.compile(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d')
+
+# The first dot of an IP address followed by the rest of it. Starts with
+# a literal, so the regex engine finds it much faster than IPPattern
+IPFirstDotPattern = re.compile(r'\.\d{1,3}\.\d{1,3}\.\d')
+
+
+class IPPortTokenizer:
+    """Find pairs of IP address and port in a single pass over the page.
+
+    Returns the same results as ``IPPortPatternGlobal.findall(page)``,
+    but without the DOTALL lookahead that tries to match an IP address
+    at every position after every found IP address.
+    """
+
+    def findall(self, page):
+        proxies = []
+        m = self._search_ip(page, 0)
+        while m:
+            end = m.end()
+            nxt = self._search_ip(page, end)
+            # the port is the first 2-5 digits found after the IP address,
+            # unless the next IP address starts earlier or at the same place
+            stop = nxt.start() if nxt else len(page)
+            port = PortPattern.search(page, end, stop + 4)
+            if port and port.start() < stop:
+                port = port.group()
+            elif nxt:
+                port = ''
+            else:
+                # Neither an IP address nor a port till the end of the page.
+                # Here the regex backtracks into the last octet, so let it
+                # handle the rest of the page, which is not longer than
+                # the IP address and a port that may start inside of it
+                proxies.extend(
+                    IPPortPatternGlobal.findall(page, m.start(), end + 16)
+                )
+                break
+            proxies.append((m.group(), port))
+            m = nxt
+        return proxies
+
+    def _search_ip(self, page, pos):
+        # Equivalent of IPPattern.search(page, pos), but the heavy pattern
+        # is only tried where the cheap one has found a candidate
+        while True:
+            candidate = IPCandidatePattern.search(page, pos)
+            if not candidate:
+                return None
+            m = IPPattern.match(page, candidate.start())
+            if m:
+                return m
+            pos = candidate.start() + 1
+
+
 # IsIpPattern = re.compile(
 #     r'^(?:(?:25[0-5]|2[0-4]\d|[01]?\d\d?)\.){3}(?:25[0-5]|2[0-4]\d|[01]?\d\d?)$')
 
@@ -52,8 +111,44 @@ def get_headers(rv=False):
 
 
 def get_all_ip(page):
+    """Return the set of IP addresses on the page."""
     # TODO: add IPv6 support
-    return set(IPPattern.findall(page))
+    return {m.group() for m in iter_ips(page)}
+
+
+def iter_ips(page, pos=0, limit=None):
+    """Return an iterator over the IP addresses on the page.
+
+    Same as ``IPPattern.finditer(page, pos)``, but the pattern is only
+    tried right before the matches of ``IPFirstDotPattern`` instead of
+    at every position of the page.
+
+    :param int limit:
+        (optional) Stop before the first match that starts at or after
+        this position
+    """
+    if limit is None:
+        limit = len(page)
+    m = IPFirstDotPattern.search(page, pos)
+    while m:
+        dot = m.start()
+        # the first octet is up to 3 digits before the first dot
+        start = dot
+        while start > pos and dot - start < 3 and page[start - 1].isdecimal():
+            start -= 1
+        for i in range(start, dot):
+            if i >= limit:
+                return
+            ip = IPPattern.match(page, i)
+            if ip:
+                yield ip
+                pos = ip.end()
+                m = IPFirstDotPattern.search(page, pos)
+                break
+        else:
+            if dot >= limit:
+                return
+            m = IPFirstDotPattern.search(page, dot + 1)
 
 
 def get_status_code(resp, start=9, stop=12):
@@ -108,6 +203,104 @@ def parse_headers(headers):
     return _headers
 
 
+# {header name: b'\r\nname:'}, the keys to search for by HeaderView
+_HEADER_KEYS = {}
+_NOT_FOUND = object()
+
+
+class HeaderView(Mapping):
+    """Lazy, read-only view of the headers of a HTTP message.
+
+    Has the same items as :func:`parse_headers`, but nothing is decoded
+    or split in advance: the first line is parsed when one of its fields
+    (``Method``, ``Status``, etc.) is requested, and other headers are
+    searched for in the bytes on demand. Iteration parses all headers.
+
+    :param bytes data: The message, only the headers are kept
+    """
+
+    _FIRST_LINE = ('Version', 'Status', 'Reason', 'Method', 'Path')
+
+    def __init__(self, data):
+        end = data.find(b'\r\n\r\n')
+        self._data = bytes(data[: end + 2] if end >= 0 else data)
+        self._lower = None
+        self._first_line = None
+        self._headers = None
+        # {name: value or None}
+        self._found = {}
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def get(self, name, default=None):
+        if self._headers is not None:
+            return self._headers.get(name, default)
+        value = self._found.get(name, _NOT_FOUND)
+        if value is _NOT_FOUND:
+            if name in self._FIRST_LINE:
+                value = self._get_first_line().get(name)
+            elif name in ('Host', 'Port'):
+                self._find_host()
+                value = self._found[name]
+            else:
+                value = self._find(name)
+            self._found[name] = value
+        return default if value is None else value
+
+    def __iter__(self):
+        return iter(self._parse())
+
+    def __len__(self):
+        return len(self._parse())
+
+    def __repr__(self):
+        return '<HeaderView %r>' % self._data[:60]
+
+    def _parse(self):
+        if self._headers is None:
+            self._headers = parse_headers(self._data)
+        return self._headers
+
+    def _get_first_line(self):
+        if self._first_line is None:
+            end = self._data.find(b'\r\n')
+            line = self._data[: end if end >= 0 else None]
+            self._first_line = parse_status_line(
+                line.decode('utf-8', 'ignore')
+            )
+        return self._first_line
+
+    def _find_host(self):
+        first_line = self._get_first_line()
+        host = self._find('Host')
+        if host is None:
+            host = first_line.get('Host')
+        port = first_line.get('Port')
+        if host and ':' in host:
+            host, port = host.split(':')
+            port = int(port)
+        self._found['Host'], self._found['Port'] = host, port
+
+    def _find(self, name):
+        if self._lower is None:
+            self._lower = self._data.lower()
+        key = _HEADER_KEYS.get(name)
+        if key is None:
+            key = _HEADER_KEYS[name] = b'\r\n' + name.lower().encode() + b':'
+        # the last one wins, as in parse_headers
+        start = self._lower.rfind(key)
+        if start < 0:
+            return None
+        start += len(key)
+        end = self._data.find(b'\r\n', start)
+        value = self._data[start : end if end >= 0 else None]
+        return value.decode('utf-8', 'ignore').strip()
+
+
 def update_geoip_db():
     print('The update in progress, please waite for a while...')
     filename = 'GeoLite2-City.tar.gz'
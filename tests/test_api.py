@@ -0,0 +1,97 @@
+import pytest
+
+from proxybroker import Broker
+from proxybroker.providers import PROVIDERS, Provider
+
+
+@pytest.fixture
+def broker():
+    providers = [
+        Provider(url='http://%s.com/' % name) for name in ('a', 'b', 'c', 'd')
+    ]
+    return Broker(providers=providers)
+
+
+def _set_stat(provider, runs, runtime, received, working):
+    provider.stat.update(
+        runs=runs, runtime=runtime, received=received, working=working
+    )
+
+
+def test_schedule_providers(broker):
+    a, b, c, d = broker._providers
+    assert broker._schedule_providers([a, b, c, d], check=True) == [a, b, c, d]
+
+    _set_stat(a, runs=1, runtime=10, received=100, working=1)
+    _set_stat(b, runs=1, runtime=2, received=10, working=2)
+    _set_stat(c, runs=1, runtime=1, received=0, working=0)
+    assert broker._schedule_providers([a, b, c, d], check=True) == [d, b, a, c]
+    assert broker._schedule_providers([a, b, c, d], check=False) == [d, a, b, c]
+
+    _set_stat(d, runs=1, runtime=1, received=50, working=0)
+    assert broker._schedule_providers([a, b, c, d], check=True) == [b, a, c, d]
+    assert broker._schedule_providers([a, b, c, d], check=False) == [d, a, b, c]
+
+
+@pytest.mark.asyncio
+async def test_get_proxies_backoff(mocker, broker):
+    a, b, c, d = broker._providers
+    mocker.patch.object(Provider, 'get_proxies', return_value=set())
+
+    assert await broker._get_proxies(a) == (a, set())
+    assert broker._providers_backoff[a] == (1, 1)
+    assert broker._schedule_providers([a, b], check=True) == [b]
+    assert broker._schedule_providers([a, b], check=True) == [a, b]
+
+    await broker._get_proxies(a)
+    assert broker._providers_backoff[a] == (2, 3)
+
+    await broker._get_proxies(a)
+    assert broker._providers_backoff[a] == (3, 7)
+
+    async def found_one():
+        a.stat['received'] += 1
+        return {('127.0.0.1', '80', ())}
+
+    mocker.patch.object(Provider, 'get_proxies', side_effect=found_one)
+    await broker._get_proxies(a)
+    assert a not in broker._providers_backoff
+
+
+def test_get_provider_stats(broker):
+    a, b, c, d = broker._providers
+    a.stat.update(pages=4, fetch_time=2, bytes=2048, received=10, unique=5)
+    b.stat.update(pages=1, fetch_time=1, received=3, unique=3, working=1)
+    stats = broker.get_provider_stats()
+    assert [s['domain'] for s in stats] == ['b.com', 'a.com', 'c.com', 'd.com']
+    assert stats[1]['avg_fetch_time'] == 0.5
+    assert stats[1]['bytes'] == 2048
+    assert 'fetch_time' not in stats[1]
+    assert stats[2]['avg_fetch_time'] == 0
+
+
+@pytest.mark.asyncio
+async def test_handle_counts_unique(broker):
+    a, b, c, d = broker._providers
+    await broker._handle(('127.0.0.1', 80), provider=a)
+    await broker._handle(('127.0.0.1', 80), provider=b)
+    assert a.stat['unique'] == 1
+    assert b.stat['unique'] == 0
+
+
+def test_brokers_do_not_share_providers():
+    first, second = Broker(), Broker()
+    for a, b, template in zip(first._providers, second._providers, PROVIDERS):
+        assert a is not b and a is not template
+        assert a.url == b.url == template.url
+        assert a.stat is not b.stat and a._cache is not b._cache
+        assert a._page_hashes is not b._page_hashes
+    first_connector = first._get_connector()
+    second_connector = second._get_connector()
+    assert first_connector is not second_connector
+    first._close_connector()
+    assert first._providers[0].connector.closed
+    assert second._providers[0].connector is second_connector
+    assert not second_connector.closed
+    assert PROVIDERS[0].connector is None
+    second._close_connector()
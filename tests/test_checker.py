@@ -0,0 +1,188 @@
+import asyncio
+import gzip
+import random
+
+import pytest
+
+from proxybroker import checker
+from proxybroker.checker import (
+    _COOKIE,
+    _REFERER,
+    Checker,
+    _check_test_response,
+    _get_anonymity_lvl,
+    _JudgeBody,
+    _request,
+    _RequestTemplate,
+    _ResponseScan,
+)
+from proxybroker.errors import BadStatusError
+from proxybroker.judge import MAX_BAD_IN_ROW, MAX_ERRORS_IN_ROW, Judge
+from proxybroker.utils import HeaderView
+
+from .utils import FakeProxy
+
+
+@pytest.mark.parametrize(
+    'method,fullpath', [('GET', False), ('GET', True), ('POST', True)]
+)
+def test_request_template(method, fullpath):
+    template = _RequestTemplate(method, 'httpbin.org', '/get', fullpath)
+    req, rv = template.render()
+    expected, expected_rv = _request(method, 'httpbin.org', '/get', fullpath)
+    assert req == expected.replace(expected_rv.encode(), rv.encode())
+    assert ('PxBroker/' in req.decode()) and req.decode().count(rv) == 1
+
+
+BODY = 'User-Agent: PxBroker/0.3.2/1234\nCookie: %s\nReferer: %s\n' % (
+    _COOKIE,
+    _REFERER,
+)
+
+
+@pytest.mark.parametrize(
+    'body,correct,lvl',
+    [
+        (BODY + 'Origin: 8.8.8.8\n', True, 'High'),
+        (BODY + 'Origin: 8.8.8.8\nVia: 1.1 squid\n', True, 'Anonymous'),
+        (BODY + 'X-Proxy-Id: 1\nOrigin: 8.8.8.8\n', True, 'Anonymous'),
+        (BODY + 'X-Forwarded-For: 127.0.0.1, 8.8.8.8', True, 'Transparent'),
+        (BODY, False, None),  # no IP address
+        (BODY.replace(_COOKIE, ''), False, None),
+    ],
+)
+def test_classify_response(mocker, body, correct, lvl):
+    proxy = mocker.Mock()
+    judge = mocker.Mock()
+    judge.marks = {'via': 0, 'proxy': 0}
+    scan = _ResponseScan(body, '1234')
+    assert _check_test_response(proxy, scan) is correct
+    if correct:
+        assert _get_anonymity_lvl('127.0.0.1', proxy, judge, scan) == lvl
+
+
+def _feed(body, headers, data, size):
+    headers = HeaderView(headers)
+    for i in range(0, len(data), size):
+        if body.feed(headers, data[i : i + size]):
+            return i + size
+    return len(data)
+
+
+def test_judge_body_gzip(mocker):
+    text = BODY + 'Origin: 8.8.8.8\n'
+    rnd = random.Random(0)
+    # the compressed body contains CRLF, like the framing of chunks
+    while True:
+        data = gzip.compress((text + '%x\n' % rnd.getrandbits(64)).encode())
+        if b'\r\n' in data:
+            break
+    headers = b'HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\n\r\n'
+    # the real IP address isn't shown, so the whole body is read
+    body = _JudgeBody(mocker.Mock(), '1234', '127.0.0.1', True)
+    assert _feed(body, headers, data, 7) == len(data)
+    assert body.content == gzip.decompress(data).decode()
+
+    body = _JudgeBody(mocker.Mock(), '1234')
+    _feed(body, headers, b'\x1f\x8b\x08\x00garbage', 7)
+    assert body.content == ''
+
+
+@pytest.mark.parametrize(
+    'text,check_anon_lvl,stops',
+    [
+        (BODY + 'Origin: 8.8.8.8\n' + 'x' * 100, False, True),
+        (BODY + 'Origin: 8.8.8.8\n' + 'x' * 100, True, False),
+        (BODY + 'Origin: 127.0.0.1\n' + 'x' * 100, True, True),
+        # the IP address may continue in the next part
+        (BODY + 'Origin: 127.0.0.12\n' + 'x' * 100, True, False),
+        ('x' * 100 + BODY + 'Origin: 8.8.8.8', False, False),
+    ],
+)
+def test_judge_body_stops_early(mocker, text, check_anon_lvl, stops):
+    headers = b'HTTP/1.1 200 OK\r\n\r\n'
+    data = text.encode()
+    body = _JudgeBody(mocker.Mock(), '1234', '127.0.0.1', check_anon_lvl)
+    assert (_feed(body, headers, data, 10) < len(data)) is stops
+    assert text.startswith(body.content)
+    scan = _ResponseScan(body.content, '1234')
+    full_scan = _ResponseScan(text, '1234')
+    assert scan.is_correct == full_scan.is_correct
+    assert ('127.0.0.1' in scan.ips) == ('127.0.0.1' in full_scan.ips)
+
+
+def _checker_with_judges(mocker, works):
+    loop = asyncio.get_event_loop()
+    judges = [Judge('http://%s/' % host, loop=loop) for host in ('a', 'b')]
+
+    async def send_test_request(template, proxy, judge, real_ext_ip):
+        if not works(judge):
+            raise BadStatusError()
+        return BODY + 'Origin: 8.8.8.8', '1234'
+
+    mocker.patch.object(
+        checker, '_send_test_request', side_effect=send_test_request
+    )
+    chk = Checker(judges=judges, loop=loop)
+    for judge in judges:
+        chk.judge_pool.add(judge)
+    return chk, judges
+
+
+@pytest.mark.asyncio
+async def test_check_blames_judge(mocker):
+    chk, (broken, judge) = _checker_with_judges(
+        mocker, works=lambda judge: judge.host != 'a'
+    )
+    judge.evicted_until = float('inf')  # so the broken one is chosen
+    for _ in range(MAX_BAD_IN_ROW - 1):
+        assert not await chk._check(FakeProxy(mocker), 'HTTP')
+    for _ in range(MAX_ERRORS_IN_ROW):
+        assert not broken.is_evicted
+        # rechecked with the other judge
+        assert await chk._check(FakeProxy(mocker), 'HTTP')
+    assert broken.is_evicted and broken.error_rate > 0
+    assert judge.error_rate == 0
+    # the response time of a check is mostly the speed of the proxy
+    assert judge.latency is None
+
+
+@pytest.mark.asyncio
+async def test_check_does_not_blame_judge_for_bad_proxy(mocker):
+    chk, judges = _checker_with_judges(mocker, works=lambda judge: False)
+    for _ in range(MAX_BAD_IN_ROW * MAX_ERRORS_IN_ROW * 5):
+        assert not await chk._check(FakeProxy(mocker), 'HTTP')
+    for judge in judges:
+        assert not judge.is_evicted and judge.errors_in_row == 0
+        assert judge.error_rate == 0
+        assert judge.bad_in_row < MAX_BAD_IN_ROW
+
+
+@pytest.mark.asyncio
+async def test_check_judges(mocker):
+    loop = asyncio.get_event_loop()
+    judges = [
+        Judge(url, loop=loop)
+        for url in ('http://fast/', 'http://slow/', 'https://down/')
+    ]
+    delays = {'fast': 0.01, 'slow': 0.3, 'down': 0.05}
+
+    async def check(judge, real_ext_ip):
+        await asyncio.sleep(delays[judge.host])
+        judge.is_working = judge.host != 'down'
+        return judge.is_working
+
+    mocker.patch.object(Judge, 'check', autospec=True, side_effect=check)
+    chk = Checker(judges=judges, loop=loop)
+    pool = chk.judge_pool
+    task = asyncio.ensure_future(chk.check_judges())
+    await asyncio.wait_for(pool.ev['HTTP'].wait(), 0.2)
+    assert pool.available['HTTP'] == [judges[0]]
+    with pytest.warns(UserWarning, match='HTTPS'):
+        await asyncio.wait_for(pool.ev['HTTPS'].wait(), 0.2)
+    assert not pool.available['HTTPS'] and 'HTTPS' not in chk._ngtrs
+    # there are no SMTP judges at all
+    assert pool.ev['SMTP'].is_set() and 'CONNECT:25' not in chk._ngtrs
+    await task
+    assert pool.available['HTTP'] == judges[:2]
+    assert chk._judges == judges[:2]
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from proxybroker.judge import (
+    EVICTION_TIME,
+    MAX_BAD_IN_ROW,
+    MAX_ERRORS_IN_ROW,
+    Judge,
+    JudgePool,
+)
+
+
+@pytest.fixture
+def judges():
+    loop = asyncio.new_event_loop()
+    yield [Judge('http://%s/' % host, loop=loop) for host in ('fast', 'slow')]
+    loop.close()
+
+
+def test_judge_pool(judges):
+    pools = JudgePool(), JudgePool()
+    pools[0].add(judges[0])
+    assert pools[0].ev['HTTP'].is_set()
+    assert pools[0].available['HTTP'] == [judges[0]]
+    assert not pools[1].ev['HTTP'].is_set()
+    assert pools[1].get_random('HTTP') is None
+
+
+def test_judge_pool_get_random(judges):
+    fast, slow = judges
+    pool = JudgePool()
+    pool.add(fast)
+    pool.add(slow)
+    # both are unmeasured, so they are equal
+    chosen = [pool.get_random('HTTP') for _ in range(2000)]
+    assert 850 < chosen.count(fast) < 1150
+
+    fast.latency, slow.latency = 0.1, 1
+    chosen = [pool.get_random('SOCKS5') for _ in range(2000)]
+    assert chosen.count(fast) > 1700
+    assert pool.get_random('HTTP', exclude=fast) is slow
+    assert pool.get_random('HTTPS') is None
+
+    slow.evicted_until = float('inf')
+    assert {pool.get_random('HTTP') for _ in range(100)} == {fast}
+    # all judges are evicted
+    assert pool.get_random('HTTP', exclude=fast) is slow
+
+
+def test_judge_health(mocker, judges):
+    now = mocker.patch('time.time', return_value=1000)
+    judge = judges[0]
+    for _ in range(MAX_BAD_IN_ROW - 1):
+        assert not judge.record_bad_response()
+    judge.record_success()
+    assert judge.bad_in_row == 0
+    for _ in range(MAX_BAD_IN_ROW - 1):
+        judge.record_bad_response()
+    assert judge.record_bad_response()  # the proxy is rechecked
+    assert judge.error_rate == 0  # bad responses are blamed on proxies
+    for _ in range(MAX_ERRORS_IN_ROW - 1):
+        assert not judge.record_failure()
+    assert judge.record_failure()
+    assert 0.3 < judge.error_rate < 0.4
+    judge.record_success()
+    assert judge.errors_in_row == 0 and 0.2 < judge.error_rate < 0.3
+
+    judge.evict()
+    assert judge.is_evicted
+    assert judge.errors_in_row == judge.bad_in_row == 0
+    judge.evict()  # already evicted
+    now.return_value = 1000 + EVICTION_TIME
+    assert not judge.is_evicted
+    judge.evict()  # the second eviction is twice as long
+    assert judge.evicted_until == 1000 + EVICTION_TIME * 3
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from proxybroker import checker, metrics
+from proxybroker.checker import Checker
+from proxybroker.judge import Judge
+from proxybroker.metrics import Counter, Gauge, Histogram, Registry
+from proxybroker.server import Server
+
+from .utils import FakeProxy
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter(registry):
+    counter = registry.register(
+        Counter('checks_total', 'Checks', ('proto', 'result'))
+    )
+    counter.inc('HTTP', 'working')
+    counter.inc('HTTP', 'working')
+    counter.add(3, 'SOCKS5', 'failed')
+    assert counter.get('HTTP', 'working') == 2
+    assert registry.render() == (
+        '# HELP checks_total Checks\n'
+        '# TYPE checks_total counter\n'
+        'checks_total{proto="HTTP",result="working"} 2\n'
+        'checks_total{proto="SOCKS5",result="failed"} 3\n'
+    )
+
+
+def test_gauge(registry):
+    gauge = registry.register(Gauge('in_flight', 'In flight'))
+    assert registry.render() == '\n'  # nothing is recorded yet
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert 'in_flight 1\n' in registry.render()
+    gauge.func = lambda: {('HTTP',): 5}
+    gauge.labels = ('scheme',)
+    assert 'in_flight{scheme="HTTP"} 5\n' in registry.render()
+
+
+def test_histogram(registry):
+    hist = registry.register(
+        Histogram('duration_seconds', 'Duration', ('proto',), buckets=(1, 5))
+    )
+    for value in (0.5, 1, 3, 10):
+        hist.observe(value, 'HTTP')
+    assert hist.get('HTTP') == 4
+    assert registry.render().splitlines()[2:] == [
+        'duration_seconds_bucket{proto="HTTP",le="1"} 2',
+        'duration_seconds_bucket{proto="HTTP",le="5"} 3',
+        'duration_seconds_bucket{proto="HTTP",le="+Inf"} 4',
+        'duration_seconds_sum{proto="HTTP"} 14.5',
+        'duration_seconds_count{proto="HTTP"} 4',
+    ]
+
+
+def test_response():
+    resp = metrics.response('/metrics')
+    assert resp.startswith(b'HTTP/1.1 200 OK\r\n')
+    assert b'Content-Type: text/plain; version=0.0.4' in resp
+    assert metrics.response('/').startswith(b'HTTP/1.1 404 Not Found\r\n')
+
+
+@pytest.mark.asyncio
+async def test_server_metrics_endpoint(mocker):
+    async def drain():
+        pass
+
+    metrics.REGISTRY.clear()
+    metrics.RELAYED_BYTES.add(100, 'downstream')
+    reader = asyncio.StreamReader()
+    reader.feed_data(b'GET /metrics HTTP/1.1\r\nHost: 127.0.0.1:8888\r\n\r\n')
+    writer = mocker.Mock()
+    writer.drain.side_effect = drain
+    server = Server('127.0.0.1', 0, proxies=None)
+    await server._handle(reader, writer)
+    resp = writer.write.call_args[0][0]
+    assert resp.startswith(b'HTTP/1.1 200 OK\r\n')
+    assert b'relayed_bytes_total{direction="downstream"} 100' in resp
+
+
+@pytest.mark.asyncio
+async def test_judge_time_of_check(mocker):
+    metrics.REGISTRY.clear()
+    loop = asyncio.get_event_loop()
+    judge = Judge('http://judge/', loop=loop)
+    chk = Checker(judges=[judge], loop=loop)
+    chk.judge_pool.add(judge)
+    body = 'PxBroker/0.3.2/1234 %s %s 8.8.8.8' % (
+        checker._COOKIE,
+        checker._REFERER,
+    )
+
+    async def send_test_request(*args):
+        return body, '1234'
+
+    mocker.patch.object(
+        checker, '_send_test_request', side_effect=send_test_request
+    )
+    assert await chk._check(FakeProxy(mocker), 'HTTP')
+    assert metrics.JUDGE_TIME.get('judge') == 1
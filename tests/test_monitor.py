@@ -0,0 +1,66 @@
+import asyncio
+import sys
+import time
+
+import pytest
+
+from proxybroker import metrics, monitor
+from proxybroker.monitor import LoopMonitor, _get_culprit
+from proxybroker.proxy import Proxy
+
+
+def test_get_lag():
+    mon = LoopMonitor(loop=asyncio.new_event_loop())
+    # blocked during [9, 10], [19.5, 20] and [29, 30]
+    mon._beats.extend([(10, 1), (20, 0.5), (30, 1)])
+    assert mon.get_lag(0, 40) == 2.5
+    assert mon.get_lag(9.5, 19.75) == 0.75
+    assert mon.get_lag(10, 19) == 0
+    assert mon.get_lag(29.5, 29.75) == 0.25
+
+
+def test_proxy_log_discounts_lag(mocker):
+    mon = LoopMonitor(loop=asyncio.new_event_loop())
+    now = time.time()
+    mon._beats.append((now - 1, 2))
+    mocker.patch.object(monitor, '_current', mon)
+    proxy = Proxy('127.0.0.1', 80)
+    proxy.log('GET / HTTP/1.1', stime=now - 4)
+    assert proxy._runtimes[-1] > 3.9  # not asked for
+    mon.discount_lag = True
+    proxy.log('GET / HTTP/1.1', stime=now - 4)
+    assert 1.9 < proxy._runtimes[-1] < 2.1
+
+
+def test_get_culprit():
+    where = []
+    gauge = metrics.Gauge('test', 'Test')
+
+    def func():
+        where.append(_get_culprit(sys._getframe()))
+        return 0
+
+    gauge.func = func
+    gauge.collect()
+    # the innermost function of proxybroker, not the callback
+    assert where == ['proxybroker.metrics.collect']
+
+
+@pytest.mark.asyncio
+async def test_watchdog_reports_stall():
+    def _block():
+        time.sleep(0.3)
+
+    mon = LoopMonitor(interval=0.02, slow_callback=0.05).start()
+    try:
+        assert monitor.get_current() is mon
+        await asyncio.sleep(0.05)
+        _block()
+        await asyncio.sleep(0.05)
+    finally:
+        mon.stop()
+    assert monitor.get_current() is None
+    (where, blocked), = mon.stalls.items()
+    assert where.endswith('._block')
+    assert blocked >= 0.1
+    assert mon.get_lag(time.time() - 1) >= 0.25
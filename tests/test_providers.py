@@ -0,0 +1,112 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from proxybroker.providers import PageParser, PageStore, Provider
+
+
+@pytest.fixture
+def provider():
+    return Provider(url='http://example.com/proxies/')
+
+
+def test_is_parsed(provider):
+    page = '127.0.0.1:80'
+    url = provider.url
+    assert provider._is_parsed(page, url) is False
+    provider._set_parsed(page, url)
+    assert provider._is_parsed(page, url) is True
+    assert provider._is_parsed(page + '\n', url) is False
+    assert provider._is_parsed(page, url, method='POST') is False
+    assert provider._is_parsed(page, url, data={'p': 1}) is False
+    provider._set_parsed('', url)
+    assert provider._is_parsed('', url) is False
+
+
+def test_update_cache(provider):
+    url = provider.url
+    provider._update_cache(url, {'ETag': '"abc"'}, 'page')
+    assert provider._cache[url] == ({'If-None-Match': '"abc"'}, 'page')
+
+    lm = 'Wed, 21 Oct 2015 07:28:00 GMT'
+    provider._update_cache(url, {'Last-Modified': lm}, 'page2')
+    assert provider._cache[url] == ({'If-Modified-Since': lm}, 'page2')
+
+    provider._update_cache(url, {}, 'page3')
+    assert url not in provider._cache
+
+
+@pytest.mark.asyncio
+async def test_find_on_page_skips_unchanged(mocker, provider):
+    page = 'abc 127.0.0.1:80 def 127.0.0.2:8080'
+    mocker.patch.object(provider, 'get', side_effect=[page, page])
+    find_proxies = mocker.spy(provider, 'find_proxies')
+
+    await provider._find_on_page(provider.url)
+    await provider._find_on_page(provider.url)
+
+    assert find_proxies.call_count == 1
+    assert provider.proxies == {
+        ('127.0.0.1', '80', ()),
+        ('127.0.0.2', '8080', ()),
+    }
+
+
+@pytest.mark.asyncio
+async def test_find_on_page_reparses_failed(mocker, provider):
+    page = 'abc 127.0.0.1:80'
+    mocker.patch.object(provider, 'get', side_effect=[page, page])
+    mocker.patch.object(
+        provider,
+        'find_proxies',
+        side_effect=[ValueError(), [('127.0.0.1', '80')]],
+    )
+
+    await provider._find_on_page(provider.url)
+    assert not provider.proxies
+    await provider._find_on_page(provider.url)
+    assert provider.proxies == {('127.0.0.1', '80', ())}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('executor', [ThreadPoolExecutor, ProcessPoolExecutor])
+async def test_find_on_page_in_executor(mocker, executor):
+    parser = PageParser(executor(max_workers=1), max_pending=1)
+    provider = Provider(url='http://example.com/proxies/', parser=parser)
+    page = 'abc 127.0.0.1:80 def 127.0.0.2:8080'
+    # patch the class, the instance is pickled for the worker process
+    mocker.patch.object(Provider, 'get', side_effect=[page])
+    try:
+        await provider._find_on_page(provider.url)
+    finally:
+        parser.close()
+    assert provider.proxies == {
+        ('127.0.0.1', '80', ()),
+        ('127.0.0.2', '8080', ()),
+    }
+
+
+@pytest.mark.asyncio
+async def test_record_and_replay_pages(mocker, tmpdir):
+    page = 'abc 127.0.0.1:80 def 127.0.0.2:8080'
+    data = {'page': 2}
+    recorder = Provider(
+        url='http://example.com/proxies/', store=PageStore(str(tmpdir))
+    )
+    mocker.patch.object(recorder, '_get', side_effect=[page, page])
+    assert await recorder.get(recorder.url) == page
+    assert await recorder.get(recorder.url, data=data, method='POST') == page
+
+    player = Provider(
+        url='http://example.com/proxies/',
+        store=PageStore(str(tmpdir), replay=True),
+    )
+    _get = mocker.patch.object(player, '_get')
+    assert await player.get(player.url) == page
+    assert await player.get(player.url, data=data, method='POST') == page
+    assert await player.get(player.url, data=data) == ''
+    assert await player.get('http://example.com/other/') == ''
+    assert _get.call_count == 0
+    assert player.stat['pages'] == 2
+    assert player.stat['errors'] == 2
+    assert player.stat['bytes'] == len(page) * 2
@@ -253,6 +253,11 @@ async def test_recv_content_encoding_without_eof(event_loop, proxy):
         b'\x1f\x8b\x08\x00\n\x00\x00'
     )
     proxy.reader.feed_data(resp)
+    # the body is complete, even though it doesn't end with a newline
+    assert await proxy.recv() == resp
+    proxy.reader._buffer.clear()
+
+    proxy.reader.feed_data(resp.replace(b'Length: 7', b'Length: 8'))
     with pytest.raises(ProxyTimeoutError):
         await proxy.recv()
 
@@ -274,3 +279,49 @@ async def test_recv_content_encoding_chunked(proxy):
     )
     proxy.reader.feed_data(resp)
     assert await proxy.recv() == resp
+
+
+@pytest.mark.asyncio
+async def test_recv_chunked(proxy):
+    resp = (
+        b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+        b'5\r\nab\r\nc\r\n3;ext=1\r\n0\r\n\r\n0\r\nX-Trailer: 1\r\n\r\n'
+    )
+    # nothing after the end of the response is read
+    proxy.reader.feed_data(resp + b'HTTP/1.1')
+    assert await proxy.recv() == resp
+    assert proxy.reader._buffer == b'HTTP/1.1'
+
+
+@pytest.mark.asyncio
+async def test_recv_no_body(proxy):
+    resp = b'HTTP/1.1 304 Not Modified\r\nServer: 0\r\n\r\n'
+    proxy.reader.feed_data(resp)
+    assert await proxy.recv() == resp
+    resp = b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n'
+    proxy.reader.feed_data(resp)
+    assert await proxy.recv() == resp
+
+
+@pytest.mark.asyncio
+async def test_recv_feed(proxy):
+    head = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+    parts = []
+
+    def feed(headers, data):
+        assert headers['Status'] == 200
+        parts.append(data)
+        return data == b'stop'
+
+    proxy.reader.feed_data(head + b'2\r\n\r\n\r\n4\r\nstop\r\n1\r\nx\r\n')
+    assert await proxy.recv(feed=feed) == head
+    assert parts == [b'\r\n', b'stop']
+    assert proxy.reader._buffer == b'1\r\nx\r\n'
+
+    proxy.reader._buffer.clear()
+    parts.clear()
+    head = b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n'
+    proxy.reader.feed_data(head + b'abcdeHTTP/1.1')
+    assert await proxy.recv(feed=feed) == head
+    assert parts == [b'abcde']
+    assert proxy.reader._buffer == b'HTTP/1.1'
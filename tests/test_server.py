@@ -0,0 +1,478 @@
+import asyncio
+import time
+
+import pytest
+
+from proxybroker import monitor
+from proxybroker.errors import ErrorOnStream, ProxyConnError
+from proxybroker.proxy import Proxy
+from proxybroker.server import (
+    EVICTED,
+    HALF_OPEN,
+    HEALTHY,
+    QUARANTINED,
+    ProxyPool,
+    Server,
+)
+
+
+def _writer(mocker):
+    async def drain():
+        pass
+
+    writer = mocker.Mock()
+    writer.drain.side_effect = drain
+    return writer
+
+
+def _streams(mocker):
+    client_reader = asyncio.StreamReader()
+    client_writer = _writer(mocker)
+    proxy = mocker.Mock()
+    proxy.reader = asyncio.StreamReader()
+    proxy.writer = _writer(mocker)
+    return client_reader, client_writer, proxy
+
+
+@pytest.mark.asyncio
+async def test_relay_idle_timeout(mocker):
+    streams = _streams(mocker)
+    server = Server('127.0.0.1', 0, proxies=None, timeout=0.1)
+    stime = time.time()
+    with pytest.raises(ErrorOnStream) as excinfo:
+        await server._relay(*streams, scheme='HTTPS')
+    assert 'TimeoutError' in repr(excinfo.value)
+    assert time.time() - stime < 1
+
+
+@pytest.mark.asyncio
+async def test_relay_is_not_idle_while_proxy_sends(mocker):
+    client_reader, client_writer, proxy = _streams(mocker)
+    server = Server('127.0.0.1', 0, proxies=None, timeout=0.1)
+
+    async def download():
+        # the client sends nothing longer than the timeout
+        for _ in range(5):
+            proxy.reader.feed_data(b'x' * 10)
+            await asyncio.sleep(0.05)
+        proxy.reader.feed_eof()
+        client_reader.feed_eof()
+
+    asyncio.ensure_future(download())
+    await server._relay(client_reader, client_writer, proxy, scheme='HTTPS')
+    sent = b''.join(c[0][0] for c in client_writer.write.call_args_list)
+    assert sent == b'x' * 50
+    assert client_writer.close.called
+
+
+@pytest.mark.asyncio
+async def test_relay_is_not_idle_while_client_reads(mocker):
+    client_reader, client_writer, proxy = _streams(mocker)
+    server = Server('127.0.0.1', 0, proxies=None, timeout=0.1)
+
+    async def drain():
+        await asyncio.sleep(0.3)  # the client reads slowly
+
+    async def finish():
+        await asyncio.sleep(0.35)
+        proxy.reader.feed_eof()
+        client_reader.feed_eof()
+
+    client_writer.drain.side_effect = drain
+    proxy.reader.feed_data(b'x' * 10)
+    asyncio.ensure_future(finish())
+    await server._relay(client_reader, client_writer, proxy, scheme='HTTPS')
+    sent = b''.join(c[0][0] for c in client_writer.write.call_args_list)
+    assert sent == b'x' * 10
+
+
+def _server_with_pool(*proxies):
+    server = Server('127.0.0.1', 0, proxies=None, timeout=1, hedge=True)
+    for proxy in proxies:
+        server._proxy_pool.put(proxy)
+    return server
+
+
+def _proxy(port):
+    proxy = Proxy('127.0.0.1', port, timeout=0.1)
+    proxy.types.update({'HTTP': 'High'})
+    return proxy
+
+
+def _get(pool, expected, key=None):
+    conn = pool.get_nowait('HTTP', key)
+    if expected is None:
+        assert conn is None
+    else:
+        assert pool._conns[conn] is expected
+    return conn
+
+
+def test_proxy_pool_get_nowait():
+    pool = ProxyPool(proxies=None)
+    assert pool.get_nowait('HTTP') is None
+    proxy = _proxy(80)
+    pool.put(proxy)
+    assert pool.get_nowait('HTTPS') is None
+    conn = pool.get_nowait('http')
+    assert conn is not proxy
+    assert (conn.host, conn.port, conn.stat) == (proxy.host, 80, proxy.stat)
+    assert pool.get_inflight(proxy) == 1
+    assert pool.get_nowait('HTTP') is None
+    pool.put(conn)
+    assert pool.get_inflight(proxy) == 0
+    assert pool.get_nowait('HTTP') is not None
+
+
+def test_get_hedge_delay():
+    server = _server_with_pool()
+    assert server._get_hedge_delay() == 0.5
+    server._resp_times.extend([0.1] * 95 + [2] * 5)
+    assert server._get_hedge_delay() == 2
+    server._resp_times.extend([0.1] * 10)
+    assert server._get_hedge_delay() == 0.1
+
+
+@pytest.mark.asyncio
+async def test_hedged_request(mocker):
+    slow, fast = _proxy(8080), _proxy(3128)
+    server = _server_with_pool(fast)
+    server._resp_times.extend([0.01] * 20)
+
+    async def request_head(proxy, proto, headers, request):
+        if proxy is slow:
+            await asyncio.sleep(1)
+        return 1, b'HTTP/1.1 200 OK\r\n\r\n'
+
+    mocker.patch.object(server, '_request_head', side_effect=request_head)
+    proxy, stime, head = await server._hedged_request(
+        0, slow, 'HTTP', {'Method': 'GET'}, b'GET / HTTP/1.1\r\n\r\n'
+    )
+    assert server._proxy_pool._conns[proxy] is fast
+    assert head == b'HTTP/1.1 200 OK\r\n\r\n'
+    assert slow.stat['errors'] == {'hedge_lost': 1}
+    _get(server._proxy_pool, slow)
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_fails(mocker):
+    first, second = _proxy(8080), _proxy(3128)
+    server = _server_with_pool(second)
+    server._resp_times.extend([0.01] * 20)
+
+    async def request_head(proxy, proto, headers, request):
+        await asyncio.sleep(0.05)
+        raise ProxyConnError()
+
+    mocker.patch.object(server, '_request_head', side_effect=request_head)
+    with pytest.raises(ProxyConnError):
+        await server._hedged_request(
+            0, first, 'HTTP', {'Method': 'GET'}, b'GET / HTTP/1.1\r\n\r\n'
+        )
+    # the second proxy is returned to the pool, the first one by the caller
+    _get(server._proxy_pool, second)
+    _get(server._proxy_pool, None)
+
+
+def test_proxy_pool_take_idle():
+    pool = ProxyPool(proxies=None)
+    proxies = [_proxy(port) for port in (80, 81, 82, 83, 84)]
+    for i, proxy in enumerate(proxies):
+        proxy._runtimes.append(i + 1)
+        pool.put(proxy)
+    taken = pool.take_idle(4, exclude={proxies[0]})
+    assert len(taken) == 2
+    assert proxies[0] not in taken
+    assert len(pool._pool) == 3
+    assert pool.take_idle(4) == [proxies[0]]
+    assert pool.take_idle(4) == [proxies[3]]
+    assert pool.take_idle(4) == []  # the last idle proxy is left for clients
+
+
+@pytest.mark.asyncio
+async def test_probe(mocker):
+    proxy = _proxy(8080)
+    server = _server_with_pool()
+    pool = server._proxy_pool
+    server.prober = mocker.Mock()
+    results = iter([False, True, False, False])
+
+    async def probe(proxy):
+        return next(results)
+
+    server.prober.probe.side_effect = probe
+
+    await server._probe(proxy)  # demoted
+    assert server._probed[proxy][1] == 1
+    pool.put(_get(pool, proxy))
+    pool.take_idle(1)
+    await server._probe(proxy)
+    assert server._probed[proxy][1] == 0
+    pool.put(_get(pool, proxy))
+    pool._pinned['client'] = (proxy, time.time() + 60)
+    await server._probe(proxy)
+    await server._probe(proxy)  # evicted
+    assert proxy not in server._probed
+    assert pool.get_state(proxy) == EVICTED
+    assert 'client' not in pool._pinned
+    _get(pool, None)
+
+    # the proxy evicted by the pool is forgotten too
+    results = iter([True])
+    proxy = _proxy(3128)
+    await server._probe(proxy)
+    assert proxy in server._probed
+    pool.evict(proxy)
+    assert not server._probed
+
+
+def test_proxy_pool_circuit_breaker(mocker):
+    now = mocker.patch('time.time', return_value=1000)
+    pool = ProxyPool(
+        proxies=None, max_errors_in_row=2, quarantine_time=10, max_quarantines=2
+    )
+    proxy = _proxy(8080)
+    pool.put(proxy)
+
+    pool.put(_get(pool, proxy), failed=True)
+    assert pool.get_state(proxy) == HEALTHY
+    pool.put(_get(pool, proxy))  # success resets the errors
+    pool.put(_get(pool, proxy), failed=True)
+    pool.put(_get(pool, proxy), failed=True)
+    assert pool.get_state(proxy) == QUARANTINED
+    _get(pool, None)
+
+    now.return_value = 1010
+    conn = _get(pool, proxy)
+    assert pool.get_state(conn) == HALF_OPEN
+    pool.put(conn, failed=True)  # the second quarantine is twice as long
+    assert pool.get_state(proxy) == QUARANTINED
+    now.return_value = 1029
+    _get(pool, None)
+    now.return_value = 1030
+    pool.put(_get(pool, proxy))
+    assert pool.get_state(proxy) == HEALTHY
+
+    for _ in range(2):
+        pool.put(_get(pool, proxy), failed=True)
+    now.return_value = 1040
+    pool.put(_get(pool, proxy), failed=True)
+    now.return_value = 1060
+    pool.put(_get(pool, proxy), failed=True)  # evicted after 2 quarantines
+    now.return_value = 2000
+    _get(pool, None)
+    assert pool.get_state(proxy) == EVICTED
+    pool.put(proxy)  # not returned by late requests
+    _get(pool, None)
+
+
+def test_proxy_pool_sticky(mocker):
+    now = mocker.patch('time.time', return_value=1000)
+    pool = ProxyPool(proxies=None, sticky_ttl=10)
+    first, second = _proxy(8080), _proxy(3128)
+    first._runtimes.append(1)
+    second._runtimes.append(2)
+    pool.put(second)
+    pool.put(first)
+
+    conn = _get(pool, first, key='a')
+    # the pinned proxy is busy
+    pool.put(_get(pool, second, key='a'))
+    pool.put(conn)
+    pool.put(_get(pool, first, key='b'))
+    conn = _get(pool, first, key='a')
+    pool.put(conn, failed=True)  # the pin is dropped
+    pool.put(_get(pool, first, key='b'))
+    now.return_value = 1011  # expired
+    conn = _get(pool, first)
+    _get(pool, second, key='b')
+    assert pool._pinned['b'][0] is second
+
+
+@pytest.mark.parametrize(
+    'strategy', ['best', 'p2c', 'least_outstanding', 'weighted']
+)
+def test_proxy_pool_strategies(strategy):
+    pool = ProxyPool(proxies=None, strategy=strategy, max_inflight=2)
+    proxies = [_proxy(port) for port in (80, 81, 82)]
+    for i, proxy in enumerate(proxies):
+        proxy._runtimes.append(i + 1)
+        pool.put(proxy)
+    conns = [pool.get_nowait('HTTP') for _ in range(6)]
+    assert all(conns)
+    assert pool.get_nowait('HTTP') is None
+    assert all(pool.get_inflight(proxy) == 2 for proxy in proxies)
+    for conn in conns:
+        pool.put(conn)
+    assert not pool._inflight
+
+
+def test_proxy_pool_select():
+    proxies = [_proxy(port) for port in (80, 81, 82)]
+    for i, proxy in enumerate(proxies):
+        proxy._runtimes.append(i + 1)
+
+    pool = ProxyPool(proxies=None, strategy='best', max_inflight=5)
+    pool._inflight[proxies[0]] = 4
+    assert pool._select(proxies) is proxies[0]
+
+    pool = ProxyPool(proxies=None, strategy='least_outstanding')
+    pool._inflight.update({proxies[0]: 4, proxies[1]: 1})
+    assert pool._select(proxies) is proxies[2]
+
+    pool = ProxyPool(proxies=None, strategy='weighted')
+    chosen = [pool._select(proxies) for _ in range(3000)]
+    # weights are 1, 1/2 and 1/3 of the total 11/6
+    assert 1500 < chosen.count(proxies[0]) < 1800
+    assert 450 < chosen.count(proxies[2]) < 650
+
+    with pytest.raises(ValueError):
+        ProxyPool(proxies=None, strategy='random')
+
+
+def test_get_affinity_key(mocker):
+    writer = mocker.Mock()
+    writer.get_extra_info.return_value = ('127.0.0.1', 54321)
+    headers = {'Host': 'example.com', 'X-Proxy-Session': 'abc'}
+    assert _server_with_pool()._get_affinity_key(writer, headers) is None
+    for sticky, key in (
+        ('client', '127.0.0.1'),
+        ('header', 'abc'),
+        ('host', 'example.com'),
+    ):
+        server = Server('127.0.0.1', 0, proxies=None, sticky=sticky)
+        assert server._get_affinity_key(writer, headers) == key
+    with pytest.raises(ValueError):
+        Server('127.0.0.1', 0, proxies=None, sticky='cookie')
+
+
+@pytest.mark.asyncio
+async def test_proxy_pool_waits_for_released():
+    queue = asyncio.Queue()
+    pool = ProxyPool(proxies=queue, max_inflight=2)
+    proxy = _proxy(8080)
+    pool.put(proxy)
+    conns = [await pool.get('HTTP') for _ in range(2)]
+
+    waiting = asyncio.ensure_future(pool.get('HTTP'))
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+    pool.put(conns[0])
+    conn = await asyncio.wait_for(waiting, 1)
+    assert pool._conns[conn] is proxy
+    assert pool.get_inflight(proxy) == 2
+
+    # a new proxy is used if it is found before a busy one is released
+    waiting = asyncio.ensure_future(pool.get('HTTP'))
+    await asyncio.sleep(0.01)
+    new = _proxy(3128)
+    await queue.put(new)
+    conn = await asyncio.wait_for(waiting, 1)
+    assert pool._conns[conn] is new
+
+
+@pytest.mark.asyncio
+async def test_proxy_pool_keeps_pin_of_busy_proxy():
+    queue = asyncio.Queue()
+    pool = ProxyPool(proxies=queue)
+    pinned, new = _proxy(8080), _proxy(3128)
+    pool.put(pinned)
+    _get(pool, pinned, key='a')
+    await queue.put(new)
+    # the pinned proxy is busy, so a new one is imported
+    assert pool._conns[await pool.get('HTTP', key='a')] is new
+    assert pool._pinned['a'][0] is pinned
+    # the key without a pin is pinned to the imported proxy
+    await queue.put(_proxy(8000))
+    assert pool._conns[await pool.get('HTTP', key='b')].port == 8000
+    assert pool._pinned['b'][0].port == 8000
+
+
+@pytest.mark.asyncio
+async def test_probed_proxy_unblocks_waiting(mocker):
+    server = Server('127.0.0.1', 0, proxies=asyncio.Queue())
+    pool = server._proxy_pool
+    for port in (8080, 3128):
+        pool.put(_proxy(port))
+    probed, = pool.take_idle(1)
+    assert pool.get_nowait('HTTP')  # the other proxy is busy
+    server.prober = mocker.Mock()
+
+    async def probe(proxy):
+        await asyncio.sleep(0.05)
+        return True
+
+    server.prober.probe.side_effect = probe
+    waiting = asyncio.ensure_future(pool.get('HTTP'))
+    await server._probe(probed)
+    conn = await asyncio.wait_for(waiting, 1)
+    assert pool._conns[conn] is probed
+
+
+@pytest.mark.asyncio
+async def test_proxy_pool_waits_for_quarantine():
+    pool = ProxyPool(
+        proxies=asyncio.Queue(), max_errors_in_row=1, quarantine_time=0.1
+    )
+    proxy = _proxy(8080)
+    pool.put(proxy)
+    pool.put(_get(pool, proxy), failed=True)
+    assert pool.get_state(proxy) == QUARANTINED
+    conn = await asyncio.wait_for(pool.get('HTTP'), 1)
+    assert pool._conns[conn] is proxy
+    assert pool.get_state(proxy) == HALF_OPEN
+
+
+def test_proxy_pool_forgets_evicted(mocker):
+    mocker.patch('proxybroker.server.MAX_EVICTED', 2)
+    pool = ProxyPool(proxies=None, max_errors_in_row=1, max_quarantines=0)
+    proxies = [_proxy(port) for port in (80, 81, 82)]
+    for proxy in proxies:
+        pool.put(proxy)
+        pool.put(_get(pool, proxy), failed=True)
+        assert pool.get_state(proxy) == EVICTED
+    assert not pool._states
+    assert list(pool._evicted) == proxies[1:]
+
+
+@pytest.mark.asyncio
+async def test_sticky_header_is_not_forwarded(mocker):
+    server = Server('127.0.0.1', 0, proxies=None, sticky='header')
+    server._proxy_pool.put(_proxy(8080))
+    request = (
+        b'GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n'
+        b'x-proxy-session: abc\r\nAccept: */*\r\n\r\n'
+    )
+    client_reader = asyncio.StreamReader()
+    client_reader.feed_data(request)
+
+    async def noop(*args, **kwargs):
+        pass
+
+    mocker.patch.object(Proxy, 'connect', side_effect=noop)
+    send = mocker.patch.object(Proxy, 'send', side_effect=noop)
+    mocker.patch.object(server, '_relay', side_effect=noop)
+    await server._handle(client_reader, _writer(mocker))
+    send.assert_called_once_with(
+        b'GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n'
+        b'Accept: */*\r\n\r\n'
+    )
+    assert 'abc' in server._proxy_pool._pinned
+
+
+def test_start_does_not_monitor_loop(mocker):
+    async def noop(*args, **kwargs):
+        pass
+
+    async def start_server(*args, **kwargs):
+        srv = mocker.Mock(sockets=[mocker.Mock()])
+        srv.wait_closed.side_effect = noop
+        return srv
+
+    mocker.patch('asyncio.start_server', side_effect=start_server)
+    loop = asyncio.new_event_loop()
+    server = Server('127.0.0.1', 0, proxies=None, loop=loop)
+    server.start()
+    assert monitor.get_current() is None
+    server.stop()
+    loop.close()
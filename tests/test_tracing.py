@@ -0,0 +1,69 @@
+import json
+
+from proxybroker import tracing
+from proxybroker.proxy import Proxy
+from proxybroker.tracing import ChromeTracer, Tracer
+
+
+class ListTracer(Tracer):
+    def __init__(self):
+        self.spans = []
+
+    def on_end(self, span):
+        self.spans.append(span)
+
+
+def test_span_without_tracer():
+    assert tracing.get_tracer() is None
+    first = tracing.span('connect', proto='HTTP')
+    assert first is tracing.span('recv')
+    with first:
+        pass
+
+
+def test_span(mocker):
+    tracer = ListTracer()
+    mocker.patch.object(tracing, '_tracer', tracer)
+    with tracing.span('connect', proto='HTTP'):
+        pass
+    try:
+        with tracing.span('recv'):
+            raise ValueError
+    except ValueError:
+        pass
+    connect, recv = tracer.spans
+    assert (connect.name, connect.attrs) == ('connect', {'proto': 'HTTP'})
+    assert connect.duration >= 0
+    assert recv.attrs == {'error': 'ValueError'}
+
+
+def test_chrome_tracer(mocker, tmpdir):
+    path = str(tmpdir.join('trace.json'))
+    tracer = ChromeTracer(path)
+    mocker.patch.object(tracing, '_tracer', tracer)
+    proxy = Proxy('127.0.0.1', 80)
+    with tracing.span('check', proxy=proxy):
+        with tracing.span('connect', proxy=proxy, proto='HTTP'):
+            pass
+    with tracing.span('judges'):
+        pass
+    with tracing.span('resolve', proxy='127.0.0.1', port=80):
+        pass
+    tracer.close()
+
+    with open(path) as f:
+        events = json.load(f)
+    rows = {
+        e['args']['name']: e['tid'] for e in events if e['ph'] == 'M'
+    }
+    spans = {e['name']: e for e in events if e['ph'] == 'X'}
+    assert set(rows) == {'127.0.0.1:80', 'broker'}
+    assert set(spans) == {'geo', 'check', 'connect', 'judges', 'resolve'}
+    assert spans['connect']['tid'] == rows['127.0.0.1:80']
+    assert spans['connect']['args'] == {'proto': 'HTTP'}
+    assert spans['judges']['tid'] == rows['broker']
+    assert spans['resolve']['tid'] == rows['127.0.0.1:80']
+    assert spans['resolve']['args'] == {}
+    check, connect = spans['check'], spans['connect']
+    assert check['ts'] <= connect['ts']
+    assert connect['ts'] + connect['dur'] <= check['ts'] + check['dur']
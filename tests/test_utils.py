@@ -1,7 +1,13 @@
+import random
+
 import pytest
 
 from proxybroker.errors import BadStatusLine
 from proxybroker.utils import (
+    HeaderView,
+    IPPattern,
+    IPPortPatternGlobal,
+    IPPortTokenizer,
     get_all_ip,
     get_status_code,
     parse_headers,
@@ -14,6 +20,31 @@ def test_get_all_ip():
     assert get_all_ip(page) == {'127.0.0.1', '127.0.0.2'}
 
 
+def test_get_all_ip_is_equal_to_regex():
+    rnd = random.Random(0)
+    for _ in range(2000):
+        page = ''.join(rnd.choice('0125..9 a') for _ in range(40))
+        assert get_all_ip(page) == set(IPPattern.findall(page))
+
+
+@pytest.mark.parametrize(
+    'page',
+    [
+        '',
+        '<td>127.0.0.1</td><td>8080</td>',
+        '127.0.0.1:80\n127.0.0.2:3128\n127.0.0.3',
+        '127.0.0.1 127.0.0.2 <b>:</b> 1234567',
+        '1.2.3.45.6.7.8 9',
+        '9.57.2.271b9. .2.1',
+        '10.0.0.1 x9 1.1.1.1x 99912.3.4.5 y 80',
+        '<tr><td>192.168.1.1</td>\n<td>\n<span>80</span></td></tr>' * 50,
+    ],
+)
+def test_ip_port_tokenizer(page):
+    expected = IPPortPatternGlobal.findall(page)
+    assert IPPortTokenizer().findall(page) == expected
+
+
 def test_get_status_code():
     assert get_status_code('HTTP/1.1 200 OK\r\n') == 200
     assert get_status_code('<html>123</html>\r\n') == 400
@@ -69,3 +100,26 @@ def test_parse_headers():
         'Content-Type': 'text/html; charset=UTF-8',
     }
     assert parse_headers(resp) == hdrs
+
+
+@pytest.mark.parametrize(
+    'data',
+    [
+        b'GET /go HTTP/1.1\r\nContent-Length: 0\r\nHost: host.com\r\n\r\n',
+        b'HTTP/1.1 200 OK\r\ncontent-length: 4\r\nServer:  x \r\n\r\nbody',
+        b'CONNECT host.com:443 HTTP/1.1\r\nHost: host.com\r\n\r\n',
+        b'GET http://host.com:8080/ HTTP/1.1\r\nHost: host.com:8080\r\n'
+        b'X-Session: 1\r\nx-session: 2\r\n\r\n',
+        b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked',  # without the end
+    ],
+)
+def test_header_view(data):
+    hdrs = parse_headers(data)
+    view = HeaderView(data)
+    for name, value in hdrs.items():
+        assert view[name] == value
+    assert view.get('Content-Encoding') is None
+    assert 'Content-Encoding' not in view
+    with pytest.raises(KeyError):
+        view['Content-Encoding']
+    assert dict(view) == hdrs
@@ -9,3 +9,22 @@ def future_iter(*args):
         f = asyncio.Future()
         f.set_result(resp)
         yield f
+
+
+class FakeProxy:
+    def __init__(self, mocker):
+        self.types = {}
+        self.log = self.close = mocker.Mock()
+        self._ngtr = mocker.Mock(use_full_path=False, check_anon_lvl=False)
+        self._ngtr.negotiate.side_effect = self.connect
+
+    async def connect(self, **kwargs):
+        pass
+
+    @property
+    def ngtr(self):
+        return self._ngtr
+
+    @ngtr.setter
+    def ngtr(self, proto):
+        self._ngtr.name = proto